@@ -0,0 +1,214 @@
+import ast
+import json
+import logging
+import re
+import threading
+import typing
+
+from pydantic import BaseModel, ValidationError
+from ruamel.yaml import YAML
+from ruamel.yaml.error import YAMLError
+
+# create logger
+logger = logging.getLogger(__name__)
+
+yaml = YAML(typ="safe")
+
+# answers parsed locally and answers handed to the extractor LLM, of all builders in this process
+stats = {"local": 0, "fallback": 0}
+_stats_lock = threading.Lock()
+
+TAG_PATTERN = re.compile(r"^\s*[#*]*\s*<([A-Za-z ]+)>[*:]*\s*", re.MULTILINE)
+BULLET_PATTERN = re.compile(r"^\s*(?:[-*•+]|\d+[.)])\s+")
+HEADING_PATTERN = re.compile(r"^\s*(?:#+\s*)?\**([^:*#]+?)\**\s*(?::\**\s*(.*))?$")
+MAX_HEADING_WORDS = 4
+# trailing rating of an item, e.g. `(Relevance: 4/5)`, formatted with the field name
+RATING_PATTERN = r"\s*[(\[]?\b{}\b\s*[:=]?\s*(\d+)(?:\s*/\s*\d+)?[)\]]?\.?\s*$"
+# leading label of an item, e.g. `Highlight 1:`, formatted with the field name
+LABEL_PATTERN = r"^\s*{}\s*\d*\s*:\s*"
+
+
+def record(parsed_locally: bool):
+    with _stats_lock:
+        stats["local" if parsed_locally else "fallback"] += 1
+
+
+def reset_stats():
+    with _stats_lock:
+        for key in stats:
+            stats[key] = 0
+
+
+def fallback_rate() -> float:
+    """Fraction of the answers that needed the extractor LLM"""
+    with _stats_lock:
+        total = stats["local"] + stats["fallback"]
+        return stats["fallback"] / total if total else 0.0
+
+
+def _field_name(text: str) -> str:
+    return re.sub(r"[^a-z]+", "_", text.lower()).strip("_")
+
+
+def split_sections(text: str) -> dict:
+    """Split the chain output on its `<Tag>` prefixes, keyed by the tag in snake case"""
+    sections = {}
+    matches = list(TAG_PATTERN.finditer(text))
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match else len(text)
+        sections[_field_name(match.group(1))] = text[match.end():end].strip()
+    return sections
+
+
+def parse_items(text: str) -> list:
+    """Items of a bulleted or numbered list, lines without a bullet continue the previous item"""
+    items = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if BULLET_PATTERN.match(line) or not items:
+            items.append(BULLET_PATTERN.sub("", line).strip())
+        else:
+            items[-1] += " " + line.strip()
+    return items
+
+
+def parse_groups(text: str, names: list, split_inline: bool = False) -> list:
+    """
+    (name, items) of the items listed under headings mentioning one of the names.
+    A heading is a short line like `Technical Skills:` or `## Summary`, bulleted or not,
+    items may follow its colon on the same line, comma separated with `split_inline`.
+    """
+    groups = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        heading = HEADING_PATTERN.match(BULLET_PATTERN.sub("", line))
+        is_heading = (
+            heading
+            and len(heading.group(1).split()) <= MAX_HEADING_WORDS
+            and (heading.group(2) is not None or line.lstrip().startswith(("#", "**")))
+            and _match_name(heading.group(1), names)
+        )
+        if is_heading:
+            inline = (heading.group(2) or "").strip()
+            items = [s.strip() for s in inline.split(",")] if split_inline else [inline]
+            groups.append((_match_name(heading.group(1), names), [item for item in items if item]))
+        elif groups:
+            groups[-1][1].extend(parse_items(line))
+    return groups
+
+
+def parse_structured(text: str):
+    """JSON, Python literal or YAML list or dict of the text, None if it is none of them"""
+    text = re.sub(r"^```\w*|```$", "", text.strip()).strip()
+    for loads in (json.loads, ast.literal_eval):
+        try:
+            value = loads(text)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+        return value if isinstance(value, (dict, list)) else None
+    try:
+        value = yaml.load(text)
+    except YAMLError:
+        return None
+    return value if isinstance(value, (dict, list)) else None
+
+
+def _is_list(field) -> bool:
+    return typing.get_origin(field.outer_type_) in (list, typing.List)
+
+
+def _match_name(heading: str, names: list):
+    """The longest name mentioned in the heading, so `non_technical_skills` wins over `technical_skills`"""
+    heading = _field_name(heading)
+    matches = [name for name in names if _field_name(name) in heading]
+    return max(matches, key=len) if matches else None
+
+
+def _parse_item_model(item: str, position: int, model: typing.Type[BaseModel]) -> dict:
+    """
+    Fields of a one line item: numeric fields from a trailing `(name: N)` rating,
+    the first text field from the rest of the line, without a leading `Name N:` label.
+    Items without a rating are ranked in the order they are listed.
+    """
+    value = {}
+    for name, field in model.__fields__.items():
+        if field.type_ is int:
+            rating = re.search(RATING_PATTERN.format(name), item, re.IGNORECASE)
+            if rating:
+                value[name] = int(rating.group(1))
+                item = item[:rating.start()]
+            else:
+                enum = field.field_info.extra.get("enum")
+                value[name] = max(max(enum) - position, min(enum)) if enum else position + 1
+    for name, field in model.__fields__.items():
+        if field.type_ is str:
+            value[name] = re.sub(LABEL_PATTERN.format(name), "", item, flags=re.IGNORECASE).strip()
+            break
+    return value
+
+
+def _parse_grouped_models(text: str, model: typing.Type[BaseModel]) -> list:
+    """Items grouped under headings, for models with a text field naming the group and a list field of items"""
+    label = next((n for n, f in model.__fields__.items() if f.type_ is str and not _is_list(f)), None)
+    items = next((n for n, f in model.__fields__.items() if f.type_ is str and _is_list(f)), None)
+    if not label or not items:
+        return None
+    enum = model.__fields__[label].field_info.extra.get("enum")
+    if not enum:
+        return None
+    return [{label: heading, items: group_items} for heading, group_items in parse_groups(text, enum) if group_items]
+
+
+def parse_final_answer(text: str, field):
+    """Convert the <Final Answer> text to the type of the `final_answer` field"""
+    if field.type_ is str and not _is_list(field):
+        items = parse_items(text)
+        return items[0] if len(items) == 1 else text.strip()
+    if _is_list(field):
+        if field.type_ is str:
+            return parse_items(text)
+        if issubclass(field.type_, BaseModel):
+            grouped = _parse_grouped_models(text, field.type_)
+            if grouped is not None:
+                return grouped
+            return [_parse_item_model(item, i, field.type_) for i, item in enumerate(parse_items(text))]
+    if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+        value = {}
+        for name, group_items in parse_groups(text, list(field.type_.__fields__), split_inline=True):
+            value.setdefault(name, []).extend(group_items)
+        return value
+    return text.strip()
+
+
+def parse_answer(text: str, pydantic_object: typing.Type[BaseModel]):
+    """
+    Parse the output of a reasoning chain into `pydantic_object` without calling an LLM.
+    The output is split on its `<Plan>`, `<Additional Steps>`, `<Work>` and `<Final Answer>` prefixes,
+    and the final answer is read as JSON, a Python literal, bullets or YAML.
+    :return: The validated output as a dict, or None if it does not match `pydantic_object`
+    """
+    sections = split_sections(text or "")
+    if "final_answer" not in sections:
+        return None
+    fields = pydantic_object.__fields__
+    output = {
+        name: parse_items(sections.get(name, ""))
+        for name in fields if name != "final_answer"
+    }
+    # a structured answer is preferred over reading the same text as bullets
+    candidates = [parse_structured(sections["final_answer"])]
+    try:
+        candidates.append(parse_final_answer(sections["final_answer"], fields["final_answer"]))
+    except (AttributeError, TypeError, ValueError) as e:
+        logger.debug(f"Final answer could not be parsed as {pydantic_object.__name__}: {e}")
+    for final_answer in candidates:
+        # an empty answer means the text was not understood
+        if not final_answer:
+            continue
+        try:
+            return pydantic_object.parse_obj({**output, "final_answer": final_answer}).dict()
+        except ValidationError:
+            continue
+    return None
@@ -1,4 +1,9 @@
+import os
+
+# app.run below uses the debug reloader, whose parent process must not start the task workers
+os.environ.setdefault('FLASK_DEBUG', '1')
+
 from app import app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True)
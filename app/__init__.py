@@ -1,4 +1,7 @@
+import os
+
 from flask import Flask
+from flask.helpers import get_debug_flag
 from flask_pymongo import PyMongo
 from flask_cors import CORS
 
@@ -15,4 +18,23 @@ app.debug = True
 
 mongo = PyMongo(app)
 
+from app.models import ensure_indexes
+
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    """Create the Mongo indexes of all collections, run as `START_TASK_WORKERS=false flask ensure-indexes`"""
+    ensure_indexes()
+
+
+def _serving_process():
+    """False in the parent process of the debug reloader, which only restarts the server"""
+    return os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not get_debug_flag()
+
+
 from app import routes
+
+# `flask run` imports this package and never runs app.py, so the server starts up here
+if app.config.get('START_TASK_WORKERS') and _serving_process():
+    ensure_indexes()
+    routes.task_pool.start()
@@ -0,0 +1,59 @@
+import queue
+import threading
+import time
+
+
+class TaskEvents:
+    """
+    In-process publish/subscribe of task progress events.
+    Events are kept per task until `retention_seconds` after the task finished, so subscribers that
+    connect late still receive the earlier events.
+    """
+
+    final_events = ("done", "failed")
+
+    def __init__(self, retention_seconds=600):
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._history = {}
+        self._subscribers = {}
+        self._finish_times = {}
+
+    def publish(self, task_id, event):
+        event = {**event, "task_id": task_id, "timestamp": time.time()}
+        with self._lock:
+            self._purge()
+            self._history.setdefault(task_id, []).append(event)
+            if event["event"] in self.final_events:
+                self._finish_times[task_id] = time.time()
+            for subscriber in self._subscribers.get(task_id, ()):
+                subscriber.put(event)
+
+    def subscribe(self, task_id):
+        """Return a queue receiving the past and future events of the task"""
+        subscriber = queue.Queue()
+        with self._lock:
+            for event in self._history.get(task_id, []):
+                subscriber.put(event)
+            self._subscribers.setdefault(task_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, task_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(task_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(task_id, None)
+
+    def clear(self, task_id):
+        """Forget the events of a previous run of the task"""
+        with self._lock:
+            self._history.pop(task_id, None)
+            self._finish_times.pop(task_id, None)
+
+    def _purge(self):
+        expired_time = time.time() - self.retention_seconds
+        for task_id, finish_time in list(self._finish_times.items()):
+            if finish_time < expired_time:
+                del self._finish_times[task_id]
+                self._history.pop(task_id, None)
@@ -1,22 +1,51 @@
 from app import mongo
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
+
+import utils
+
+# Subdocument for data only used by the server, such as reusable LLM outputs. It is never returned by reads.
+INTERNAL_FIELD = 'internal'
 
 
 def _format_data(data: dict) -> dict:
     if data is not None and '_id' in data:
         data['id'] = str(data['_id'])
         del data['_id']
-        del data['delete_time']
-        del data['is_show']
-        del data['is_delete']
+        # these fields may be left out by a projection
+        data.pop('delete_time', None)
+        data.pop('is_show', None)
+        data.pop('is_delete', None)
+        data.pop(INTERNAL_FIELD, None)
     return data
 
 
+def _projection(projection=None):
+    """Projection of a read, the internal subdocument is never fetched"""
+    if projection is None:
+        return {INTERNAL_FIELD: 0}
+    return [field for field in projection if field.split('.')[0] != INTERNAL_FIELD]
+
+
 class BaseManager:
+    # Indexes of the collection as (keys, options). Every query filters on `is_delete: False`,
+    # so indexes only cover documents that are not deleted.
+    indexes = []
+    # Names of indexes replaced by `indexes`, dropped before these are created
+    legacy_indexes = []
+
     def __init__(self, collection_name):
         self.collection = mongo.db[collection_name]
 
+    def ensure_indexes(self):
+        existing = self.collection.index_information()
+        for name in self.legacy_indexes:
+            if name in existing:
+                self.collection.drop_index(name)
+        for keys, options in self.indexes:
+            self.collection.create_index(keys, partialFilterExpression={"is_delete": False}, **options)
+
     def create(self, data):
         current_time = datetime.now()
         data.update({
@@ -45,30 +74,70 @@ class BaseManager:
         return result.modified_count
 
     def get(self, document_id, **query_kwargs):
-        document_data = self.collection.find_one({"_id": ObjectId(document_id), "is_delete": False, **query_kwargs})
+        document_data = self.collection.find_one(
+            {"_id": ObjectId(document_id), "is_delete": False, **query_kwargs}, _projection()
+        )
         return _format_data(document_data)
 
     def query(self, **query_kwargs):
-        document_data = self.collection.find_one({"is_delete": False, **query_kwargs})
+        document_data = self.collection.find_one({"is_delete": False, **query_kwargs}, _projection())
         return _format_data(document_data)
 
-    def get_by_ids(self, document_ids, **query_kwargs):
+    def get_by_ids(self, document_ids, projection=None, **query_kwargs):
         """
         Query the corresponding results based on multiple document_ids
         :param document_ids: A list containing multiple ObjectIds
+        :param projection: Optional list of fields to return, all fields are returned by default
         :param query_kwargs: Additional query parameters to filter results
         :return: List containing query results
         """
         document_data = self.collection.find(
-            {"_id": {"$in": [ObjectId(id) for id in document_ids]}, "is_delete": False, **query_kwargs}
+            {"_id": {"$in": [ObjectId(id) for id in document_ids]}, "is_delete": False, **query_kwargs},
+            _projection(projection)
         )
         return [_format_data(doc) for doc in document_data]
 
-    def list(self):
-        return [_format_data(doc) for doc in self.collection.find({"is_delete": False})]
+    def query_in(self, field, values, projection=None, sort=None, **query_kwargs):
+        """
+        Query the documents whose field matches any of the values in a single round trip
+        :param field: Name of the field to match
+        :param values: A list of values to match
+        :param projection: Optional list of fields to return, all fields are returned by default
+        :param sort: Optional list of (key, direction) pairs to sort results
+        :param query_kwargs: Additional query parameters to filter results
+        :return: List containing query results
+        """
+        document_data = self.collection.find(
+            {field: {"$in": list(values)}, "is_delete": False, **query_kwargs}, _projection(projection), sort=sort
+        )
+        return [_format_data(doc) for doc in document_data]
+
+    def iterate(self, limit=None, after=None, projection=None):
+        """
+        Yield documents in `_id` order as they arrive from the Mongo cursor
+        :param limit: Maximum number of documents, all documents are returned by default
+        :param after: Only return documents after this id, used to fetch the next page
+        :param projection: Optional list of fields to return, all fields are returned by default
+        """
+        query = {"is_delete": False}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        cursor = self.collection.find(query, _projection(projection)).sort("_id", 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        for doc in cursor:
+            yield _format_data(doc)
+
+    def list(self, limit=None, after=None, projection=None):
+        return list(self.iterate(limit=limit, after=after, projection=projection))
 
 
 class ResumeManager(BaseManager):
+    indexes = [
+        ([("raw_id", 1)], {"name": "raw_id_active"}),
+        ([("job_id", 1)], {"name": "job_id_active"}),
+    ]
+
     def __init__(self):
         super().__init__('resume')
 
@@ -80,12 +149,107 @@ class ResumeManager(BaseManager):
         })
         return super().create(data)
 
+    def latest_section_outputs(self, job_id):
+        """
+        LLM outputs of the most recent resume generated for a job, keyed by a fingerprint of their inputs
+        :param job_id: Id of the job
+        """
+        document_data = self.collection.find_one(
+            {"job_id": job_id, "is_raw": False, "is_delete": False},
+            {f"{INTERNAL_FIELD}.section_outputs": 1},
+            sort=[("_id", -1)]
+        )
+        return ((document_data or {}).get(INTERNAL_FIELD) or {}).get('section_outputs') or {}
+
 
 class JobManager(BaseManager):
+    indexes = [
+        ([("raw_hash", 1), ("status", 1)], {"name": "raw_hash_status_active"}),
+    ]
+    # full index on the same keys, created before the indexes became partial
+    legacy_indexes = ["raw_hash_1_status_1"]
+
     def __init__(self):
         super().__init__('job')
 
+    def create(self, data):
+        if data.get('raw'):
+            data['raw_hash'] = utils.text_hash(data['raw'])
+        return super().create(data)
+
+    def update(self, document_id, update_data):
+        if update_data.get('raw'):
+            update_data['raw_hash'] = utils.text_hash(update_data['raw'])
+        return super().update(document_id, update_data)
+
+    def find_parsed(self, raw):
+        """
+        Find a job with the same posting text that has already been parsed
+        :param raw: Raw text of the job posting
+        :return: The parsed job document, or None
+        """
+        return self.query(raw_hash=utils.text_hash(raw), status=2)  # 0: waiting, 1: pending, 2: done
+
 
 class TaskManager(BaseManager):
+    indexes = [
+        # tasks of a job, oldest first
+        ([("job_id", 1), ("_id", 1)], {"name": "job_id_active"}),
+        # waiting tasks in queue order
+        ([("status", 1), ("update_time", 1)], {"name": "status_update_time_active"}),
+        # pending tasks by last heartbeat
+        ([("status", 1), ("heartbeat_time", 1)], {"name": "status_heartbeat_time_active"}),
+    ]
+
     def __init__(self):
         super().__init__('task')
+
+    def claim(self, worker_id):
+        """
+        Atomically move the oldest waiting task to pending, so only one worker runs it
+        :param worker_id: Identifier of the claiming worker
+        :return: The claimed task, or None if no task is waiting
+        """
+        current_time = datetime.now()
+        document_data = self.collection.find_one_and_update(
+            {"is_delete": False, "status": 0},  # 0: waiting, 1: pending, 2: done, 3: failed
+            {"$set": {
+                "status": 1,
+                "worker_id": worker_id,
+                "heartbeat_time": current_time,
+                "update_time": current_time
+            }},
+            sort=[("update_time", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        return _format_data(document_data)
+
+    def heartbeat(self, document_ids):
+        """Mark pending tasks as still being worked on"""
+        result = self.collection.update_many(
+            {"_id": {"$in": [ObjectId(id) for id in document_ids]}, "status": 1},
+            {"$set": {"heartbeat_time": datetime.now()}}
+        )
+        return result.modified_count
+
+    def requeue_orphaned(self, lease_seconds):
+        """
+        Move pending tasks back to waiting when their worker stopped sending heartbeats, e.g. after a crash
+        :param lease_seconds: Seconds without heartbeat after which a task is considered orphaned
+        :return: Number of requeued tasks
+        """
+        expired_time = datetime.now() - timedelta(seconds=lease_seconds)
+        result = self.collection.update_many(
+            {"is_delete": False, "status": 1, "$or": [
+                {"heartbeat_time": {"$lt": expired_time}},
+                {"heartbeat_time": {"$exists": False}}
+            ]},
+            {"$set": {"status": 0, "update_time": datetime.now()}, "$unset": {"worker_id": ""}}
+        )
+        return result.modified_count
+
+
+def ensure_indexes():
+    """Create the indexes of all collections, existing indexes are left untouched"""
+    for manager in (ResumeManager(), JobManager(), TaskManager()):
+        manager.ensure_indexes()
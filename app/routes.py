@@ -1,23 +1,83 @@
+import functools
 import time
 
-from flask import jsonify, request
+from bson import ObjectId
+from flask import Response, json, jsonify, request, stream_with_context
 from app import app
-from app.models import ResumeManager, JobManager, TaskManager
-import threading
+from app.models import INTERNAL_FIELD, ResumeManager, JobManager, TaskManager
+from app.events import TaskEvents
+from app.worker import TaskWorkerPool
 import logging
-from pipeline import Pipeline
+import queue
+import utils
+from model_router import ModelRouter
+from pdf_renderer import PdfRenderer
+from yaml_to_json import json_to_yaml
 
 # create logger
-from prompts import Job_Post
-
 logger = logging.getLogger(__name__)
 
+# progress events of the tasks run by this process
+task_events = TaskEvents()
+
 
 @app.route('/', methods=['GET'])
 def index():
     return "hello world"
 
 
+def _list_args():
+    """
+    Query parameters of the list endpoints:
+    limit: page size, all documents are returned by default
+    after: id of the last document of the previous page
+    fields: comma separated fields to return
+    stream: return newline delimited JSON streamed from the Mongo cursor
+    """
+    fields = request.args.get('fields')
+    after = request.args.get('after')
+    limit = request.args.get('limit')
+    # validated here, as streamed responses only query Mongo once the response is sent
+    if after is not None and not ObjectId.is_valid(after):
+        raise ValueError(f"Invalid id for after: {after}")
+    if limit is not None:
+        if not limit.strip().isdigit() or int(limit) <= 0:
+            raise ValueError(f"Invalid limit, expected a positive integer: {limit}")
+        limit = int(limit)
+    return dict(
+        limit=limit,
+        after=after,
+        projection=fields.split(',') if fields else None,
+    )
+
+
+def _bool_arg(name):
+    """Boolean query parameter, true when given without a value"""
+    if name not in request.args:
+        return False
+    value = request.args.get(name).strip().lower()
+    if value in ('', '1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f"Invalid boolean for {name}: {value}")
+
+
+def _stream_ndjson(documents):
+    def generate():
+        for document in documents:
+            yield json.dumps(document) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _next_page_headers(documents, limit):
+    # The next page starts after the last document of a full page
+    if limit and len(documents) == limit:
+        return {'X-Next-After': documents[-1]['id']}
+    return {}
+
+
 # Resume APIs
 @app.route('/resume', methods=['POST'])
 def insert_resume():
@@ -39,6 +99,25 @@ def get_resume(resume_id):
     return jsonify({"error": "Resume not found"}), 404
 
 
+@app.route('/resume/<resume_id>/pdf', methods=['GET'])
+def get_resume_pdf(resume_id):
+    manager = ResumeManager()
+    resume = manager.get(resume_id)
+    if not resume:
+        return jsonify({"error": "Resume not found"}), 404
+    template_file = request.args.get('template', 'resume.tex')
+    if template_file not in utils.get_tex_environment().list_templates():
+        return jsonify({"error": "Template not found"}), 404
+    try:
+        # stored resumes have the skills of the web editor, the templates a list of categories
+        pdf = pdf_renderer.render(json_to_yaml(resume), template_file=template_file)
+    except Exception as e:
+        return jsonify({"error": "PDF could not be generated. " + str(e)}), 500
+    return Response(pdf, mimetype='application/pdf', headers={
+        'Content-Disposition': f'inline; filename="{resume_id}.pdf"'
+    })
+
+
 @app.route('/resume/<resume_id>', methods=['PUT'])
 def update_resume(resume_id):
     try:
@@ -63,9 +142,15 @@ def delete_resume(resume_id):
 
 @app.route('/resumes', methods=['GET'])
 def list_resumes():
-    manager = ResumeManager()
-    resumes = manager.list()
-    return jsonify(resumes)
+    try:
+        manager = ResumeManager()
+        list_args = _list_args()
+        if _bool_arg('stream'):
+            return _stream_ndjson(manager.iterate(**list_args))
+        resumes = manager.list(**list_args)
+        return jsonify(resumes), 200, _next_page_headers(resumes, list_args['limit'])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
 
 
 # Job APIs
@@ -119,9 +204,20 @@ def delete_job(job_id):
 
 @app.route('/jobs', methods=['GET'])
 def list_jobs():
-    manager = JobManager()
-    jobs = manager.list()
-    return jsonify({"message": "Jobs queried successfully", "jobs": jobs})
+    try:
+        manager = JobManager()
+        list_args = _list_args()
+        if _bool_arg('stream'):
+            return _stream_ndjson(manager.iterate(**list_args))
+        jobs = manager.list(**list_args)
+        headers = _next_page_headers(jobs, list_args['limit'])
+        return jsonify({
+            "message": "Jobs queried successfully",
+            "jobs": jobs,
+            "next_after": headers.get('X-Next-After')
+        }), 200, headers
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
 
 
 @app.route('/task', methods=['POST'])
@@ -210,10 +306,9 @@ def get_tasks():
         tasks_dict = {}
 
         jobs_dict = {str(job['id']): job for job in job_manager.get_by_ids(job_ids)}
-        for job_id in job_ids:
-            task = task_manager.query(job_id=job_id)
-            if task:
-                tasks_dict[job_id] = task
+        # Keep the first task of each job, as a query on a single job_id would
+        for task in task_manager.query_in('job_id', job_ids, sort=[('_id', 1)]):
+            tasks_dict.setdefault(task['job_id'], task)
 
         # Query resumes related to tasks in batches
         resume_ids = set(task['new_resume_id'] for task in tasks_dict.values() if task.get("status") == 2)
@@ -272,7 +367,9 @@ def run_tasks():
 def check_tasks_status():
     """
     data: {
-    "task_ids": ["001", "002"]
+    "task_ids": ["001", "002"],
+    "include_resume": true,  # optional, set to false to leave out the generated resumes
+    "resume_fields": ["basics", "work"]  # optional, only return these fields of the generated resumes
     }
     """
     try:
@@ -281,22 +378,28 @@ def check_tasks_status():
         task_ids = data.get("task_ids", [])
         if not task_ids:
             return jsonify({"error": str('task_ids is empty.')}), 400
+        include_resume = data.get("include_resume", True)
+        resume_fields = data.get("resume_fields") or None
 
         task_manager = TaskManager()
         resume_manager = ResumeManager()
+        # Batch query tasks and the resumes of done tasks
+        tasks_dict = {task['id']: task for task in task_manager.get_by_ids([id for id in task_ids if id])}
+        resumes_dict = {}
+        if include_resume:
+            resume_ids = set(task['new_resume_id'] for task in tasks_dict.values() if task.get("status") == done)
+            resumes_dict = {resume['id']: resume for resume in resume_manager.get_by_ids(resume_ids, resume_fields)}
+
         tasks = []
         for task_id in task_ids:
-            if not task_id:
-                tasks.append(None)
-                continue
-            task = task_manager.get(task_id)
+            task = tasks_dict.get(task_id)
             if not task:
                 tasks.append(None)
                 continue
 
             resume = {}
-            if task["status"] == done:
-                resume = resume_manager.get(task["new_resume_id"])
+            if task["status"] == done and include_resume:
+                resume = resumes_dict.get(task["new_resume_id"])
             tasks.append({
                 **task,
                 'resume': resume
@@ -307,78 +410,151 @@ def check_tasks_status():
         return jsonify({"error": str(e)}), 400
 
 
-def process_batch(job_ids, task_ids, resume_id, update_part):
-    print("job_ids:", job_ids)
-    print("task_ids:", task_ids)
+@app.route('/task/<task_id>/events', methods=['GET'])
+def stream_task_events(task_id):
+    """
+    Server-sent events with the progress of a task: stage_start and stage_finish for each pipeline stage,
+    then done or failed. Events are only published by the process running the task, so the task status
+    is also checked in Mongo while no event arrives.
+    """
+    keep_alive_seconds = 15
     task_manager = TaskManager()
-    for job_id, task_id in zip(job_ids, task_ids):
-        task_manager.update(task_id, {
-            'status': 1,  # 0: waiting, 1: pending, 2: done
-        })
+    if not task_manager.get(task_id):
+        return jsonify({"error": "Task not found"}), 404
 
-        start_task(update_part, resume_id, job_id, task_id)
+    def format_event(event):
+        return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+    def finished_event(task):
+        if not task:
+            return {"event": "failed", "task_id": task_id, "error": "Task not found"}
+        if task.get('status') == 2:  # 0: waiting, 1: pending, 2: done, 3: failed
+            return {"event": "done", "task_id": task_id, "new_resume_id": task.get('new_resume_id')}
+        if task.get('status') == 3:
+            return {"event": "failed", "task_id": task_id, "error": task.get('error')}
+        return None
+
+    def generate():
+        subscriber = task_events.subscribe(task_id)
+        # check Mongo right away in case the task already finished without events in this process
+        timeout = 0
+        try:
+            while True:
+                try:
+                    event = subscriber.get(timeout=timeout)
+                except queue.Empty:
+                    timeout = keep_alive_seconds
+                    event = finished_event(task_manager.get(task_id))
+                    if not event:
+                        yield ": keep-alive\n\n"
+                        continue
+                yield format_event(event)
+                if event['event'] in TaskEvents.final_events:
+                    return
+        finally:
+            task_events.unsubscribe(task_id, subscriber)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 
 def process_task_list(task_list, resume_id):
     update_part = 'resume'
-    batch_size = 5
-    num_tasks = len(task_list)
-    num_batches = (num_tasks + batch_size - 1) // batch_size
 
     task_manager = TaskManager()
     job_manager = JobManager()
-    job_ids = []
     task_ids = []
     for task in task_list:
         if 'jobId' not in task:
             job_id = job_manager.create({'raw': task['description']})
         else:
             job_id = task['jobId']
-        job_ids.append(job_id)
         task_id = task['id']
         task_manager.update(task_id, {
             'job_id': job_id,
             'raw_resume_id': resume_id,
-            'status': 0,  # 0: waiting, 1: pending, 2: done
+            'status': 0,  # 0: waiting, 1: pending, 2: done, 3: failed
             'content': task.get('content') or update_part
         })
         task_ids.append(task_id)
 
-    for i in range(num_batches):
-        start_idx = i * batch_size
-        end_idx = min((i + 1) * batch_size, num_tasks)
-        job_batch = job_ids[start_idx:end_idx]
-        task_batch = task_ids[start_idx:end_idx]
+    # Queued tasks are claimed by the worker pool
+    task_pool.notify()
+    return task_ids
 
-        # Create a thread to process the batch asynchronously
-        thread = threading.Thread(target=process_batch, args=(job_batch, task_batch, resume_id, update_part))
-        thread.start()
 
-    return task_ids
+def run_task(task):
+    print("job_id:", task['job_id'])
+    print("task_id:", task['id'])
+    task_events.clear(task['id'])
+    llm_retries = {}
+    try:
+        start_task('resume', task['raw_resume_id'], task['job_id'], task['id'], llm_retries=llm_retries)
+    except Exception as e:
+        TaskManager().update(task['id'], {'llm_retries': llm_retries})
+        task_events.publish(task['id'], {"event": "failed", "error": str(e)})
+        raise
+
+
+@functools.lru_cache(maxsize=None)
+def llm_stack():
+    """Import the prompts module configured from the app config on first use, to keep the startup of the app fast"""
+    import prompts
+    prompts.configure_llm(**{key: app.config[key] for key in prompts.llm_settings if key in app.config})
+    return prompts
+
+
+def get_parsed_job(job, job_manager):
+    """Reuse the parsed fields of the job, or of another job with the same posting text"""
+    JOB_POST_FIELDS = llm_stack().JOB_POST_FIELDS
+    parsed_job = job if job.get('status') == 2 else job_manager.find_parsed(job.get('raw', ''))
+    if parsed_job and all(field in parsed_job for field in JOB_POST_FIELDS):
+        return {field: parsed_job[field] for field in JOB_POST_FIELDS}
+    return None
 
 
 def parsing_job(raw_job, job_id):
-    job_post = Job_Post(raw_job)
-    parsed_job = job_post.parse_job_post(verbose=False)
+    manager = JobManager()
+    parsed_job = get_parsed_job({'raw': raw_job}, manager)
+    if not parsed_job:
+        job_post = llm_stack().Job_Post(raw_job, router=model_router)
+        parsed_job = job_post.parse_job_post(verbose=False)
     logger.info('parsed_job:', parsed_job)
     print("parsed_job: Done")
-    manager = JobManager()
     manager.update(job_id, {
         **parsed_job,
         'status': 2,  # 0: waiting, 1: pending, 2: done
     })
 
 
-def start_task(update_part, resume_id, job_id, task_id):
+def start_task(update_part, resume_id, job_id, task_id, llm_retries=None):
+    llm_stack()
+    from pipeline import Pipeline
+
     start_time = time.time()
     resume_manager = ResumeManager()
     resume = resume_manager.get(resume_id)
     job_manager = JobManager()
     job = job_manager.get(job_id)
 
-    ai_resume = Pipeline()
-    ai_resume.set_job_text(job)
+    ai_resume = Pipeline(
+        use_llm_cache=True,
+        persist=False,
+        on_event=lambda event: task_events.publish(task_id, event),
+        token_budget=app.config.get('PROMPT_TOKEN_BUDGET'),
+        model_router=model_router,
+    )
+    if llm_retries is not None:
+        ai_resume.llm_retries = llm_retries
+    ai_resume.set_job_text(job.get('raw', ''))
     ai_resume.set_raw_resume(resume)
+    parsed_job = get_parsed_job(job, job_manager)
+    if parsed_job:
+        ai_resume.parsed_job = parsed_job
+    # Only call the LLM for the sections whose inputs changed since the last run for this job
+    ai_resume.previous_outputs = resume_manager.latest_section_outputs(job_id)
 
     if update_part == "resume":
         ai_resume.main()
@@ -405,12 +581,38 @@ def start_task(update_part, resume_id, job_id, task_id):
         **resume,
         "is_raw": False,
         "raw_id": resume_id,
-        "job_id": job_id
+        "job_id": job_id,
+        INTERNAL_FIELD: {"section_outputs": ai_resume.section_outputs}
     })
 
     task_manager = TaskManager()
     task_manager.update(task_id, {
         'status': 2,  # 0: waiting, 1: pending, 2: done
         "time_used": time.time() - start_time,
-        "new_resume_id": new_resume_id
+        "new_resume_id": new_resume_id,
+        "llm_retries": ai_resume.llm_retries
     })
+    task_events.publish(task_id, {"event": "done", "new_resume_id": new_resume_id})
+
+
+task_pool = TaskWorkerPool(
+    handler=run_task,
+    num_workers=app.config.get('TASK_WORKERS', 2),
+    poll_interval=app.config.get('TASK_POLL_INTERVAL', 5),
+    lease_seconds=app.config.get('TASK_LEASE_SECONDS', 120),
+)
+
+model_router = ModelRouter(
+    routes=app.config.get('LLM_ROUTES'),
+    window_seconds=app.config.get('LLM_ROUTE_WINDOW_SECONDS', 300),
+)
+
+utils.configure_render_cache(
+    directory=app.config.get('RENDER_CACHE_DIR', '.render_cache'),
+    max_bytes=app.config.get('RENDER_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+)
+
+pdf_renderer = PdfRenderer(
+    max_workers=app.config.get('PDF_WORKERS', 2),
+    timeout=app.config.get('PDF_TIMEOUT', 60),
+)
@@ -0,0 +1,93 @@
+import logging
+import os
+import socket
+import threading
+import time
+
+from app.models import TaskManager
+
+logger = logging.getLogger(__name__)
+
+
+class TaskWorkerPool:
+    """
+    Fixed number of worker threads that claim waiting tasks from the `task` collection and run them.
+    Tasks stay in Mongo while they wait, so nothing is lost on restart: pending tasks whose worker
+    stopped sending heartbeats are moved back to waiting and picked up again.
+    """
+
+    def __init__(self, handler, num_workers=2, poll_interval=5, lease_seconds=120):
+        """
+        :param handler: Function called with the claimed task document
+        :param num_workers: Number of tasks run at the same time by this process
+        :param poll_interval: Seconds between checks for waiting tasks when not notified
+        :param lease_seconds: Seconds without heartbeat after which a pending task is requeued
+        """
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._active = set()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        TaskManager().requeue_orphaned(self.lease_seconds)
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(self.num_workers):
+            self._threads.append(threading.Thread(target=self._work, args=(f"{prefix}:{i}",), daemon=True))
+        self._threads.append(threading.Thread(target=self._heartbeat, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self):
+        """Wake up idle workers after new tasks have been queued"""
+        self._wakeup.set()
+
+    def _work(self, worker_id):
+        task_manager = TaskManager()
+        while True:
+            try:
+                task = task_manager.claim(worker_id)
+            except Exception as e:
+                logger.error(f"Worker {worker_id} could not claim a task: {e}")
+                task = None
+            if not task:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            with self._lock:
+                self._active.add(task['id'])
+            try:
+                self.handler(task)
+            except Exception as e:
+                logger.exception(f"Task {task['id']} failed")
+                try:
+                    task_manager.update(task['id'], {
+                        'status': 3,  # 0: waiting, 1: pending, 2: done, 3: failed
+                        'error': str(e)
+                    })
+                except Exception as update_error:
+                    # the task stays pending and is requeued once its heartbeats stop
+                    logger.error(f"Worker {worker_id} could not mark task {task['id']} as failed: {update_error}")
+            finally:
+                with self._lock:
+                    self._active.discard(task['id'])
+
+    def _heartbeat(self):
+        task_manager = TaskManager()
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self._lock:
+                    active = list(self._active)
+                if active:
+                    task_manager.heartbeat(active)
+                if task_manager.requeue_orphaned(self.lease_seconds):
+                    self.notify()
+            except Exception as e:
+                logger.error(f"Task heartbeat failed: {e}")
@@ -0,0 +1,83 @@
+"""
+Count the Mongo round trips made to fetch the tasks of many jobs, before and after batching.
+Requires the MongoDB server configured in config_development.py. Seeded documents are removed afterwards.
+
+    python -m benchmarks.bench_get_tasks --jobs 100
+"""
+import argparse
+import os
+
+from bson import ObjectId
+from pymongo import monitoring
+
+from benchmarks.common import CommandCounter
+
+counter = CommandCounter()
+# listeners must be registered before the Mongo client is created
+monitoring.register(counter)
+# only the queries of this benchmark are counted
+os.environ["START_TASK_WORKERS"] = "false"
+
+from app import app, mongo  # noqa: E402
+from app.models import JobManager, ResumeManager, TaskManager  # noqa: E402
+
+
+def seed(num_jobs):
+    job_manager = JobManager()
+    task_manager = TaskManager()
+    resume_manager = ResumeManager()
+    job_ids = []
+    for i in range(num_jobs):
+        job_id = job_manager.create({'raw': f"benchmark job {i}", 'title': "Benchmark", 'company': "Benchmark"})
+        resume_id = resume_manager.create({'basics': {'name': "Benchmark"}, 'is_raw': False, 'job_id': job_id})
+        task_manager.create({'job_id': job_id, 'status': 2, 'new_resume_id': resume_id, 'content': "resume"})
+        job_ids.append(job_id)
+    return job_ids
+
+
+def cleanup(job_ids):
+    mongo.db.task.delete_many({'job_id': {'$in': job_ids}})
+    mongo.db.resume.delete_many({'job_id': {'$in': job_ids}})
+    mongo.db.job.delete_many({'_id': {'$in': [ObjectId(id) for id in job_ids]}})
+
+
+def legacy_get_tasks(job_ids):
+    """Query pattern of the /tasks endpoint before batching: one task query per job id"""
+    task_manager = TaskManager()
+    job_manager = JobManager()
+    resume_manager = ResumeManager()
+    job_manager.get_by_ids(job_ids)
+    tasks_dict = {}
+    for job_id in job_ids:
+        task = task_manager.query(job_id=job_id)
+        if task:
+            tasks_dict[job_id] = task
+    resume_manager.get_by_ids(set(task['new_resume_id'] for task in tasks_dict.values()))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--jobs", type=int, default=100)
+    args = arg_parser.parse_args()
+
+    job_ids = seed(args.jobs)
+    try:
+        counter.reset()
+        legacy_get_tasks(job_ids)
+        before = counter.main
+
+        counter.reset()
+        response = app.test_client().post('/tasks', json={'job_ids': job_ids})
+        after = counter.main
+        assert response.status_code == 201, response.get_json()
+        assert len(response.get_json()['data']) == args.jobs
+    finally:
+        cleanup(job_ids)
+
+    print(f"jobs: {args.jobs}")
+    print(f"round trips before: {before}")
+    print(f"round trips after: {after}")
+
+
+if __name__ == "__main__":
+    main()
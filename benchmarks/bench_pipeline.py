@@ -0,0 +1,69 @@
+"""
+Per-stage latency of Pipeline.main against the offline fake LLM, no OpenAI key needed.
+
+    python -m benchmarks.bench_pipeline --runs 5 --latency 0.2
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.common import SAMPLE_JOB, sample_resume
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    arg_parser.add_argument("--experiences", type=int, default=6)
+    arg_parser.add_argument("--projects", type=int, default=5)
+    arg_parser.add_argument("--max-concurrency", type=int, default=4)
+    arg_parser.add_argument("--hedge-percentile", type=float, default=None, help="duplicate calls slower than this")
+    args = arg_parser.parse_args()
+
+    # the LLM backend is selected when prompts is imported
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+    import answer_parser
+    import fake_llm
+    import prompts
+    from pipeline import Pipeline
+
+    prompts.configure_llm(
+        LLM_CACHE_PATH=os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite"),
+        LLM_HEDGE_PERCENTILE=args.hedge_percentile,
+    )
+
+    stage_times = {}
+    prompt_tokens = {}
+    fake_llm.reset_stats()
+    answer_parser.reset_stats()
+    start_time = time.time()
+    for _ in range(args.runs):
+        pipeline = Pipeline(persist=False, max_concurrency=args.max_concurrency)
+        pipeline.set_job_text(SAMPLE_JOB)
+        pipeline.set_raw_resume(sample_resume(args.experiences, args.projects))
+        pipeline.main()
+        for stage, seconds in pipeline.stage_times.items():
+            stage_times.setdefault(stage, []).append(seconds)
+        for chain, tokens in pipeline.prompt_tokens.items():
+            prompt_tokens.setdefault(chain, []).extend(tokens)
+    elapsed = time.time() - start_time
+
+    print(f"runs: {args.runs}, fake LLM latency: {args.latency}s, wall time: {elapsed:.3f}s")
+    print(f"LLM calls per run: {fake_llm.stats['calls'] / args.runs:.1f}")
+    print(f"answers needing the extractor LLM: {answer_parser.fallback_rate():.0%}")
+    print(f"prompt tokens per run: {fake_llm.stats['prompt_tokens'] / args.runs:.0f}")
+    if prompts.hedger is not None:
+        print(f"hedged calls: {prompts.hedger.stats}")
+    print(f"{'stage':<12} {'median':>8} {'max':>8}")
+    for stage, times in stage_times.items():
+        print(f"{stage:<12} {statistics.median(times):>8.3f} {max(times):>8.3f}")
+    print(f"{'chain':<28} {'calls':>6} {'median tokens':>14} {'max':>8}")
+    for chain, tokens in prompt_tokens.items():
+        print(f"{chain:<28} {len(tokens) / args.runs:>6.1f} {statistics.median(tokens):>14.0f} {max(tokens):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Cold import time of the Flask app, measured with `python -X importtime` in a fresh interpreter.
+Exits with status 1 when the import exceeds the budget, or when the LLM stack is imported at startup,
+so it can run as a check in CI. The task workers are not started, so no MongoDB server is needed.
+
+    python -m benchmarks.bench_startup --budget 1.5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# modules that must only be imported when the first task runs
+LAZY_MODULES = ("langchain", "openai", "tiktoken", "prompts", "pipeline")
+
+
+def import_times(module: str) -> list:
+    """Return (cumulative microseconds, module name) of every module imported by `import module`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True, env={**os.environ, "START_TASK_WORKERS": "false"}
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented by two spaces per level
+        times.append((int(cumulative), name[1:].rstrip()))
+    return times
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--module", default="app")
+    arg_parser.add_argument("--budget", type=float, default=1.5, help="seconds allowed for the import")
+    arg_parser.add_argument("--top", type=int, default=15, help="number of slowest top-level imports shown")
+    args = arg_parser.parse_args()
+
+    times = import_times(args.module)
+    total = max(us for us, name in times if name == args.module) / 1e6
+    top_level = [(us, name) for us, name in times if not name.startswith(" ")]
+    print(f"import {args.module}: {total:.3f}s (budget {args.budget}s)")
+    print(f"{'module':<40} {'cumulative':>10}")
+    for us, name in sorted(top_level, reverse=True)[:args.top]:
+        print(f"{name:<40} {us / 1e6:>9.3f}s")
+
+    imported = {name.strip().split(".")[0] for _, name in times}
+    eager = [module for module in LAZY_MODULES if module in imported]
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(eager)}")
+    if total > args.budget:
+        print(f"FAIL: import time over budget by {total - args.budget:.3f}s")
+    sys.exit(1 if eager or total > args.budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Throughput of /tasks/run with N tasks against the offline fake LLM, and the Mongo round trips it makes.
+Requires the MongoDB server configured in config_development.py. Seeded documents are removed afterwards.
+
+    python -m benchmarks.bench_tasks_run --tasks 20 --latency 0.2
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bson import ObjectId
+from pymongo import monitoring
+
+from benchmarks.common import SAMPLE_JOB, CommandCounter, sample_resume
+
+arg_parser = argparse.ArgumentParser(description=__doc__)
+arg_parser.add_argument("--tasks", type=int, default=20)
+arg_parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+arg_parser.add_argument("--timeout", type=float, default=600)
+args = arg_parser.parse_args()
+
+# the pool is started by main, the LLM backend is selected when prompts is imported
+os.environ["START_TASK_WORKERS"] = "false"
+os.environ["LLM_BACKEND"] = "fake"
+os.environ["FAKE_LLM_LATENCY"] = str(args.latency)
+
+counter = CommandCounter()
+# listeners must be registered before the Mongo client is created
+monitoring.register(counter)
+
+import fake_llm  # noqa: E402
+from app import app, mongo  # noqa: E402
+from app.models import TaskManager  # noqa: E402
+from app.routes import task_pool  # noqa: E402
+
+# read by the LLM stack when the first task runs
+app.config["LLM_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "llm_cache.sqlite")
+
+
+def cleanup(task_ids):
+    tasks = TaskManager().get_by_ids(task_ids, projection=['job_id', 'raw_resume_id'])
+    job_ids = [ObjectId(task['job_id']) for task in tasks if task.get('job_id')]
+    resume_ids = [ObjectId(task['raw_resume_id']) for task in tasks if task.get('raw_resume_id')]
+    mongo.db.resume.delete_many({'$or': [{'job_id': {'$in': [str(id) for id in job_ids]}},
+                                         {'_id': {'$in': resume_ids}}]})
+    mongo.db.job.delete_many({'_id': {'$in': job_ids}})
+    mongo.db.task.delete_many({'_id': {'$in': [ObjectId(id) for id in task_ids]}})
+
+
+def main():
+    task_pool.start()
+    task_manager = TaskManager()
+    task_ids = [
+        task_manager.create({'job_id': "", 'raw_resume_id': "", 'status': -1, 'content': "resume"})
+        for _ in range(args.tasks)
+    ]
+    try:
+        fake_llm.reset_stats()
+        counter.reset()
+        start_time = time.time()
+        response = app.test_client().post('/tasks/run', json={
+            'resume': sample_resume(),
+            'task_list': [{'id': task_id, 'description': f"{SAMPLE_JOB}\nReference: {i}"}
+                          for i, task_id in enumerate(task_ids)]
+        })
+        assert response.status_code == 201, response.get_json()
+        request_time = time.time() - start_time
+        request_commands = counter.main
+
+        finished = []
+        while time.time() - start_time < args.timeout:
+            tasks = task_manager.get_by_ids(task_ids, projection=['status'])
+            finished = [task for task in tasks if task['status'] in (2, 3)]  # 2: done, 3: failed
+            if len(finished) == len(task_ids):
+                break
+            time.sleep(0.5)
+        elapsed = time.time() - start_time
+        failed = sum(1 for task in finished if task['status'] == 3)
+    finally:
+        cleanup(task_ids)
+
+    print(f"tasks: {args.tasks}, workers: {app.config.get('TASK_WORKERS')}, fake LLM latency: {args.latency}s")
+    print(f"finished: {len(finished)}, failed: {failed}, wall time: {elapsed:.3f}s")
+    print(f"throughput: {len(finished) / elapsed:.3f} tasks/s")
+    print(f"/tasks/run response time: {request_time:.3f}s, Mongo round trips: {request_commands}")
+    print(f"worker Mongo round trips per task: {counter.other / max(len(finished), 1):.1f}")
+    print(f"LLM calls per task: {fake_llm.stats['calls'] / max(len(finished), 1):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Check that answer_parser reads representative <Final Answer> outputs of each reasoning chain without the extractor LLM.
+Runs offline, every case prints ok or FAIL with the parsed answer.
+
+    python -m benchmarks.check_answer_parser
+"""
+import sys
+
+import answer_parser
+from prompts import (
+    Resume_Improver_Output,
+    Resume_Section_Highlighter_Output,
+    Resume_Skills_Matcher_Output,
+    Resume_Summarizer_Output,
+)
+
+REASONING = """<Plan>
+1. Read the job description.
+2. Compare it with the resume.
+<Additional Steps>
+- Check the keywords.
+<Work>
+Matched the resume against the requirements.
+"""
+
+# (name, output model, <Final Answer> text, expected final answer)
+CASES = [
+    (
+        "highlights rated inline",
+        Resume_Section_Highlighter_Output,
+        """<Final Answer>
+- Built the Flask APIs serving 2M requests per day (Relevance: 5)
+- Cut the p95 latency of the data pipelines by 40% (Relevance: 4/5)
+- Organized the team hackathon (relevance: 2)
+""",
+        [
+            {"highlight": "Built the Flask APIs serving 2M requests per day", "relevance": 5},
+            {"highlight": "Cut the p95 latency of the data pipelines by 40%", "relevance": 4},
+            {"highlight": "Organized the team hackathon", "relevance": 2},
+        ],
+    ),
+    (
+        "highlights labeled like YAML, ranked in order",
+        Resume_Section_Highlighter_Output,
+        """<Final Answer>:
+- Highlight 1: Built the Flask APIs serving 2M requests per day
+- Highlight 2: Mentored two engineers
+""",
+        [
+            {"highlight": "Built the Flask APIs serving 2M requests per day", "relevance": 5},
+            {"highlight": "Mentored two engineers", "relevance": 4},
+        ],
+    ),
+    (
+        "highlights as YAML",
+        Resume_Section_Highlighter_Output,
+        """<Final Answer>
+- highlight: Built the Flask APIs serving 2M requests per day
+  relevance: 5
+- highlight: Mentored two engineers
+  relevance: 3
+""",
+        [
+            {"highlight": "Built the Flask APIs serving 2M requests per day", "relevance": 5},
+            {"highlight": "Mentored two engineers", "relevance": 3},
+        ],
+    ),
+    (
+        "skills inline after their headings",
+        Resume_Skills_Matcher_Output,
+        """**<Final Answer>**
+Technical Skills: Python, Flask, MongoDB
+Non-Technical Skills: Communication, Mentoring
+""",
+        {"technical_skills": ["Python", "Flask", "MongoDB"], "non_technical_skills": ["Communication", "Mentoring"]},
+    ),
+    (
+        "skills bulleted under their headings, non-technical first",
+        Resume_Skills_Matcher_Output,
+        """<Final Answer>
+- Non-technical skills:
+  - Teamwork
+  - Problem solving
+- Technical skills:
+  - Docker
+  - AWS
+""",
+        {"technical_skills": ["Docker", "AWS"], "non_technical_skills": ["Teamwork", "Problem solving"]},
+    ),
+    (
+        "skills as JSON",
+        Resume_Skills_Matcher_Output,
+        """<Final Answer>
+```json
+{"technical_skills": ["Python"], "non_technical_skills": ["Leadership"]}
+```
+""",
+        {"technical_skills": ["Python"], "non_technical_skills": ["Leadership"]},
+    ),
+    (
+        "summary paragraph",
+        Resume_Summarizer_Output,
+        """<Final Answer>
+Backend engineer with 6 years of Python experience, building Flask services on AWS.
+Looking to grow the platform team of Acme Robotics.
+""",
+        # lines of a paragraph are joined
+        "Backend engineer with 6 years of Python experience, building Flask services on AWS. "
+        "Looking to grow the platform team of Acme Robotics.",
+    ),
+    (
+        "summary as a single bullet",
+        Resume_Summarizer_Output,
+        """<Final Answer>
+- Backend engineer with 6 years of Python experience.
+""",
+        "Backend engineer with 6 years of Python experience.",
+    ),
+    (
+        "improvements under markdown and bold headings",
+        Resume_Improver_Output,
+        """<Final Answer>
+## Summary
+- Mention the Flask experience asked for in the job post
+**Experience**:
+- Quantify the latency improvements
+- Start each highlight with a verb
+Spelling and Grammar:
+- Fix "recieve" in the second project
+""",
+        [
+            {"section": "summary", "improvements": ["Mention the Flask experience asked for in the job post"]},
+            {"section": "experience", "improvements": ["Quantify the latency improvements",
+                                                       "Start each highlight with a verb"]},
+            {"section": "spelling and grammar", "improvements": ["Fix \"recieve\" in the second project"]},
+        ],
+    ),
+]
+
+# outputs that must be left to the extractor LLM
+UNPARSED_CASES = [
+    ("no final answer", Resume_Summarizer_Output, "<Plan>\n- Summarize the resume\n"),
+    ("empty final answer", Resume_Skills_Matcher_Output, "<Final Answer>\n"),
+    ("improvements without sections", Resume_Improver_Output, "<Final Answer>\n- Looks good overall\n"),
+]
+
+
+def main():
+    failed = 0
+    for name, model, answer, expected in CASES:
+        output = answer_parser.parse_answer(REASONING + answer, model)
+        parsed = output and output["final_answer"]
+        ok = parsed == expected and output["plan"] == ["Read the job description.", "Compare it with the resume."]
+        print(f"{'ok' if ok else 'FAIL'}\t{model.__name__}\t{name}")
+        if not ok:
+            print(f"\texpected: {expected}\n\tparsed:   {parsed}")
+            failed += 1
+    for name, model, answer in UNPARSED_CASES:
+        output = answer_parser.parse_answer(answer, model)
+        print(f"{'ok' if output is None else 'FAIL'}\t{model.__name__}\t{name}")
+        if output is not None:
+            print(f"\texpected: None\n\tparsed:   {output}")
+            failed += 1
+    if failed:
+        sys.exit(f"{failed} answers were not parsed as expected")
+
+
+if __name__ == "__main__":
+    main()
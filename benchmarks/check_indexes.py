@@ -0,0 +1,55 @@
+"""
+Check with explain plans that the queries made by the managers are served by an index.
+Requires the MongoDB server configured in config_development.py.
+
+    python -m benchmarks.check_indexes
+"""
+import os
+import sys
+from datetime import datetime
+
+os.environ["START_TASK_WORKERS"] = "false"
+
+from app import mongo  # noqa: E402
+from app.models import ensure_indexes  # noqa: E402
+
+# (collection, filter, sort) of the queries that must use an index
+QUERIES = [
+    ("task", {"is_delete": False, "job_id": {"$in": ["a", "b"]}}, [("_id", 1)]),
+    ("task", {"is_delete": False, "job_id": "a"}, None),
+    ("task", {"is_delete": False, "status": 0}, [("update_time", 1)]),
+    ("task", {"is_delete": False, "status": 1, "heartbeat_time": {"$lt": datetime.now()}}, None),
+    ("resume", {"is_delete": False, "raw_id": "a"}, None),
+    ("resume", {"is_delete": False, "job_id": "a"}, None),
+    ("job", {"is_delete": False, "raw_hash": "a", "status": 2}, None),
+]
+
+
+def _stages(plan):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def main():
+    ensure_indexes()
+    failed = []
+    for collection, query, sort in QUERIES:
+        cursor = mongo.db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = set(_stages(winning_plan))
+        uses_index = "IXSCAN" in stages and "COLLSCAN" not in stages
+        print(f"{'ok' if uses_index else 'FAIL'}\t{collection}\t{query}\t{sorted(s for s in stages if s)}")
+        if not uses_index:
+            failed.append((collection, query))
+    if failed:
+        sys.exit(f"{len(failed)} queries are not served by an index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Check that resumes stored by the tasks render every skill category of the LaTeX template with its skills.
+Stored resumes have the skills of the web editor, which /resume/<id>/pdf converts with json_to_yaml.
+
+    python -m benchmarks.check_resume_tex
+"""
+import re
+import sys
+
+import utils
+from benchmarks.common import sample_resume
+from yaml_to_json import json_to_yaml, yaml_to_json
+
+SKILLS_SECTION = re.compile(r"% -+ skills -+ %(.*?)% -+ end skills -+ %", re.DOTALL)
+SKILL_ITEM = re.compile(r"\\item \\textbf\{(.*?)\}: (.*?) \\bulletSpace")
+
+
+def generated_resume() -> dict:
+    """Resume as stored by a task: the pipeline output, with skills listed by category, converted by yaml_to_json"""
+    resume = sample_resume()
+    resume["skills"] = [
+        {"category": "Technical", "skills": ["Python", "Flask", "MongoDB"]},
+        {"category": "Non-technical", "skills": ["Mentoring"]},
+    ]
+    return yaml_to_json(resume)
+
+
+def skill_items(resume: dict, template_file: str = "resume.tex") -> list:
+    """(category, skills) of the skills section of the rendered template"""
+    # rendered without the render cache, so the check always uses the current template
+    template = utils.get_tex_environment().get_template(template_file)
+    section = SKILLS_SECTION.search(template.render(**json_to_yaml(resume)))
+    return SKILL_ITEM.findall(section.group(1)) if section else []
+
+
+def main():
+    failed = False
+    for name, resume in (("generated", generated_resume()), ("edited", sample_resume())):
+        items = skill_items(resume)
+        print(f"{name} resume: {items}")
+        if not items or any(not category.strip() or not skills.strip() for category, skills in items):
+            print(f"FAIL: {name} resume renders an empty skills section")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
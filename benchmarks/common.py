@@ -0,0 +1,79 @@
+import threading
+
+from pymongo import monitoring
+
+SAMPLE_JOB = """
+Acme Robotics is hiring a Senior Backend Engineer for its Platform team (fully remote, $150k - $180k).
+You will design and operate the Python services behind our fleet management product.
+
+Responsibilities:
+- Build and maintain REST APIs with Flask and MongoDB
+- Improve the performance and reliability of data pipelines
+- Mentor engineers and review code
+
+Qualifications:
+- 5+ years of experience with Python
+- Experience with Docker, Kubernetes and AWS
+- Strong communication and teamwork skills
+"""
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count Mongo commands, separately for the main thread and the other threads (task workers)"""
+
+    def __init__(self):
+        self.main = 0
+        self.other = 0
+
+    def reset(self):
+        self.main = 0
+        self.other = 0
+
+    def started(self, event):
+        if threading.current_thread() is threading.main_thread():
+            self.main += 1
+        else:
+            self.other += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def sample_resume(num_experiences: int = 6, num_projects: int = 5) -> dict:
+    """Raw resume in the format read by Resume_Builder, with every entry marked for rewriting"""
+    return {
+        "basics": {"name": "Ada Lovelace", "email": "ada@example.com", "summary": ""},
+        "education": [
+            {"school": "University of London", "degrees": [{"names": ["BSc Mathematics"]}]}
+        ],
+        "work": [
+            {
+                "name": f"Company {i}",
+                "titles": [{"name": "Software Engineer", "startdate": "2015-01", "enddate": "2017-06"}],
+                "unedited": True,
+                "summary": f"Built Python services and data pipelines on AWS for product {i}, "
+                           f"improving latency and mentoring two engineers.",
+                "highlights": [f"Built Python services for product {i}"],
+            }
+            for i in range(num_experiences)
+        ],
+        "projects": [
+            {
+                "title": f"Project {i}",
+                "unedited": True,
+                "summary": f"Open source tool {i} to monitor Flask applications",
+                "skills": "Python, Flask, Docker",
+                "desc": [f"Open source tool {i}"],
+            }
+            for i in range(num_projects)
+        ],
+        "skills": {
+            "languages": [{"name": "Python"}, {"name": "JavaScript"}],
+            "tools": [{"name": "Docker"}, {"name": "MongoDB"}],
+            "practices": [{"name": "Teamwork"}, {"name": "Mentoring"}],
+        },
+        "activities": {"achievements": ["Speaker at PyCon"]},
+    }
@@ -1,2 +1,59 @@
+import os
+
 DEBUG = True
 MONGO_URI = 'mongodb://localhost:27017/resume'
+
+# Create the Mongo indexes and start the task workers when the app is loaded by the server, also under `flask run`.
+# Turned off with START_TASK_WORKERS=false for the benchmarks and CLI commands.
+START_TASK_WORKERS = os.environ.get('START_TASK_WORKERS', 'true').lower() not in ('0', 'false', 'no', 'off')
+# Task queue workers per process
+TASK_WORKERS = 2
+# Seconds between checks for waiting tasks
+TASK_POLL_INTERVAL = 5
+# Seconds without heartbeat after which a pending task is requeued
+TASK_LEASE_SECONDS = 120
+
+# LaTeX compilations run in parallel per process
+PDF_WORKERS = 2
+# Seconds after which a LaTeX compilation is killed
+PDF_TIMEOUT = 60
+
+# Directory caching rendered TeX and PDF files, and its maximum size in bytes
+RENDER_CACHE_DIR = '.render_cache'
+RENDER_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Maximum prompt tokens per LLM chain, None sends whole resumes
+PROMPT_TOKEN_BUDGET = None
+
+# Model of each LLM stage: job_parsing, highlighter, skills_matcher, summary, improver, extractor.
+# Stages without a route use gpt-3.5-turbo. A stage with a `fallback` model and a `latency_slo` in seconds
+# uses the fallback while the average latency of its recent calls to `model` is over the SLO, e.g.
+# {'summary': {'model': 'gpt-4', 'fallback': 'gpt-3.5-turbo', 'latency_slo': 30}}
+LLM_ROUTES = {}
+# Seconds of recent calls averaged against the latency SLOs
+LLM_ROUTE_WINDOW_SECONDS = 300
+
+# SQLite database caching the LLM answers of all processes on the host, seconds they are kept, and maximum size
+LLM_CACHE_PATH = 'llm_cache.sqlite'
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Ask for the OpenAI API key when OPENAI_API_KEY is not set. The server has no one to answer, so tasks fail instead.
+LLM_PROMPT_API_KEY = False
+# Requests and tokens per minute of the LLM calls of all processes on the host, None is unlimited
+LLM_RPM = None
+LLM_TPM = None
+# SQLite database shared by the processes to enforce these limits
+LLM_RATE_PATH = 'llm_rate.sqlite'
+# Seconds after which an LLM request is given up
+LLM_REQUEST_TIMEOUT = 60
+# Retries of rate limits, timeouts and server errors of an LLM call
+LLM_MAX_RETRIES = 3
+# Consecutive failures after which calls to a model fail fast, and seconds before it is tried again
+LLM_BREAKER_FAILURES = 5
+LLM_BREAKER_RESET_SECONDS = 30
+# Latency percentile (0 - 1) of recent calls after which an LLM call is duplicated, None disables hedging
+LLM_HEDGE_PERCENTILE = None
+# Maximum duplicated calls per call
+LLM_HEDGE_MAX_RATIO = 0.1
+# Recent calls needed before calls are duplicated
+LLM_HEDGE_MIN_SAMPLES = 20
@@ -0,0 +1,126 @@
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+
+from token_counter import count_tokens
+
+# calls and tokens of all fake chat models, used by the benchmarks
+stats = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+_stats_lock = threading.Lock()
+
+DEFAULT_ANSWER = (
+    "<Plan>\n- Follow the instruction.\n"
+    "<Work>\n- Done.\n"
+    "<Final Answer>\n- Fake answer."
+)
+
+
+def reset_stats():
+    with _stats_lock:
+        for key in stats:
+            stats[key] = 0
+
+
+def fake_value(schema: dict, definitions: dict, name: str = "value"):
+    """Deterministic value that validates against a JSON schema"""
+    if "$ref" in schema:
+        schema = definitions[schema["$ref"].split("/")[-1]]
+    if "allOf" in schema:
+        return fake_value(schema["allOf"][0], definitions, name)
+    if "enum" in schema:
+        return schema["enum"][0]
+    schema_type = schema.get("type", "string")
+    if schema_type == "object":
+        return {
+            key: fake_value(value, definitions, key)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if schema_type == "array":
+        return [fake_value(schema.get("items", {}), definitions, name)]
+    if schema_type == "integer":
+        return 1
+    if schema_type == "number":
+        return 1.0
+    if schema_type == "boolean":
+        return False
+    return f"Fake {name}"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatOpenAI returning deterministic answers after a configurable latency.
+    Function calls, used by the structured output chains, are answered with `function_responses`
+    for the function name, or with values generated from the function's JSON schema.
+    """
+
+    model_name: str = "fake"
+    model_kwargs: Dict[str, Any] = {}
+    temperature: float = 0.0
+    # seconds spent on each call
+    latency: float = 0.0
+    # fraction of the calls failing with a TimeoutError, to exercise retries
+    failure_rate: float = 0.0
+    # text answer to calls without functions
+    answer: str = DEFAULT_ANSWER
+    # function name mapped to the arguments returned for it
+    function_responses: Dict[str, dict] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "latency": self.latency, "answer": self.answer}
+
+    def _answer(self, functions: Optional[List[dict]]) -> AIMessage:
+        if not functions:
+            return AIMessage(content=self.answer)
+        function = functions[0]
+        if function["name"] in self.function_responses:
+            arguments = self.function_responses[function["name"]]
+        else:
+            parameters = function.get("parameters", {})
+            arguments = fake_value(parameters, parameters.get("definitions", {}))
+        return AIMessage(
+            content="",
+            additional_kwargs={
+                "function_call": {"name": function["name"], "arguments": json.dumps(arguments)}
+            },
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise TimeoutError("Fake LLM call timed out")
+        message = self._answer(kwargs.get("functions"))
+        prompt_tokens = count_tokens("\n".join(m.content for m in messages), self.model_name)
+        completion_tokens = count_tokens(
+            message.content or json.dumps(message.additional_kwargs), self.model_name
+        )
+        with _stats_lock:
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={
+                "token_usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+                "model_name": self.model_name,
+            },
+        )
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from langchain.cache import BaseCache
+from langchain.load.dump import dumps
+from langchain.load.load import loads
+from langchain.schema import Generation
+
+# create logger
+logger = logging.getLogger(__name__)
+
+
+class PersistentLLMCache(BaseCache):
+    """
+    LLM response cache stored in a local SQLite database, so it survives restarts and is shared by all
+    processes on the host. Entries are keyed by a hash of the LLM string (model name and parameters)
+    and the rendered prompt, expire after `ttl` seconds and are evicted least recently used first once
+    the stored responses exceed `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        database_path: str = "llm_cache.sqlite",
+        ttl: Optional[float] = 7 * 24 * 3600,
+        max_bytes: Optional[int] = 256 * 1024 * 1024,
+    ):
+        self.database_path = database_path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # a connection per operation keeps the cache safe to use from threads and processes
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl is not None and created_at < now - self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+
+        generations = []
+        for generation in json.loads(value):
+            try:
+                generations.append(loads(generation))
+            except Exception:
+                logger.warning("Cached LLM generation could not be deserialized.")
+                generations.append(Generation(text=generation))
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        value = json.dumps([dumps(generation) for generation in return_val])
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self._key(prompt, llm_string), value, len(value), now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl is not None:
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        if self.max_bytes is not None:
+            # drop the least recently used entries that don't fit in `max_bytes`
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM ("
+                "SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS total FROM llm_cache"
+                ") WHERE total > ?)",
+                (self.max_bytes,),
+            )
+
+    def clear(self, **kwargs) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
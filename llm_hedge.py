@@ -0,0 +1,117 @@
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+# create logger
+logger = logging.getLogger(__name__)
+
+
+class Hedger:
+    """
+    Hedged LLM calls: when a call has not returned after the `percentile` of the recent latencies of
+    calls with the same name, a duplicate is sent and the first answer is used.
+    Duplicates are capped at `max_hedge_ratio` of the calls, the slower call is left to finish unused.
+    Original calls run in their own thread and duplicates in a separate pool, so neither waits behind
+    the other, and latencies are measured from the start of the call.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.9,
+        max_hedge_ratio: float = 0.1,
+        min_samples: int = 20,
+        window: int = 200,
+        max_workers: int = 8,
+    ):
+        """
+        :param percentile: Latency percentile, between 0 and 1, after which a duplicate is sent
+        :param max_hedge_ratio: Maximum number of duplicates per call
+        :param min_samples: Latencies recorded for a name before its calls are hedged
+        :param window: Number of recent latencies kept per name
+        :param max_workers: Number of duplicates running at the same time, no duplicate is sent while all run
+        """
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self.max_workers = max_workers
+        self.stats = {"calls": 0, "hedges_fired": 0, "hedges_won": 0}
+        self._latencies = {}
+        self._hedges_running = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm_hedge")
+
+    def _timed(self, name: str, function):
+        """Call `function`, recording its latency when it succeeds"""
+        start_time = time.time()
+        result = function()
+        with self._lock:
+            latencies = self._latencies.setdefault(name, collections.deque(maxlen=self.window))
+            latencies.append(time.time() - start_time)
+        return result
+
+    def _start(self, name: str, function) -> Future:
+        """Run the call in a new thread, so it starts right away"""
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._timed(name, function))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"llm_call_{name}", daemon=True).start()
+        return future
+
+    def _hedge(self, name: str, function):
+        try:
+            return self._timed(name, function)
+        finally:
+            with self._lock:
+                self._hedges_running -= 1
+
+    def threshold(self, name: str):
+        """Seconds after which calls of `name` are hedged, None until enough latencies are recorded"""
+        with self._lock:
+            latencies = sorted(self._latencies.get(name, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))]
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            # a duplicate waiting for a free worker would not answer sooner
+            if self._hedges_running >= self.max_workers:
+                return False
+            if self.stats["hedges_fired"] + 1 > self.max_hedge_ratio * self.stats["calls"]:
+                return False
+            self.stats["hedges_fired"] += 1
+            self._hedges_running += 1
+            return True
+
+    def call(self, name: str, function):
+        with self._lock:
+            self.stats["calls"] += 1
+        threshold = self.threshold(name)
+        if threshold is None:
+            return self._timed(name, function)
+        primary = self._start(name, function)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._take_hedge():
+            return primary.result()
+
+        logger.info(f"Hedging {name} after {threshold:.1f}s")
+        hedge = self._executor.submit(self._hedge, name, function)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.stats["hedges_won"] += 1
+                    return future.result()
+        # both failed, report the error of the original call
+        return primary.result()
@@ -0,0 +1,125 @@
+import logging
+import random
+import threading
+import time
+
+# create logger
+logger = logging.getLogger(__name__)
+
+# errors without an HTTP status worth retrying, matched by class name so no provider SDK is imported here.
+# Base classes like openai's APIError are left out, as they also cover bad requests and bad keys.
+TRANSIENT_ERRORS = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "RateLimitError",
+    "ServiceUnavailableError",
+    "Timeout",
+    "TryAgain",
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while its circuit breaker is open"""
+
+
+def is_transient(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and connection errors"""
+    # openai>=1.0 errors have `status_code`, older ones `http_status`
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast once `failure_threshold` consecutive calls failed with transient errors.
+    After `reset_seconds` a single trial call is let through, closing the circuit again if it succeeds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.time() - self._opened_at < self.reset_seconds or self._trial_running:
+                raise CircuitOpenError(f"{self.name} is unavailable, failing fast after {self._failures} failures")
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.error(f"Circuit of {self.name} opened after {self._failures} failures")
+                self._opened_at = time.time()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Return the circuit breaker shared by all calls to `name`"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+
+def call_with_retry(
+    function,
+    max_retries: int = 3,
+    base_delay: float = 1,
+    max_delay: float = 30,
+    breaker: CircuitBreaker = None,
+    on_retry=None,
+):
+    """
+    Call `function`, retrying transient errors with exponential backoff and full jitter.
+    :param breaker: Circuit breaker checked before and updated after each attempt
+    :param on_retry: Function called with the attempt number and the error before each retry
+    """
+    attempt = 0
+    while True:
+        if breaker:
+            breaker.before_call()
+        try:
+            result = function()
+        except Exception as e:
+            if not is_transient(e):
+                # the provider answered, so it is available
+                if breaker:
+                    breaker.record_success()
+                raise
+            if breaker:
+                breaker.record_failure()
+            if attempt >= max_retries:
+                raise
+            attempt += 1
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logger.warning(f"Transient LLM error, retry {attempt}/{max_retries} in {delay:.1f}s: {e}")
+            if on_retry:
+                on_retry(attempt, e)
+            time.sleep(delay)
+            continue
+        if breaker:
+            breaker.record_success()
+        return result
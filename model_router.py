@@ -0,0 +1,69 @@
+import collections
+import logging
+import threading
+import time
+
+# create logger
+logger = logging.getLogger(__name__)
+
+
+class ModelRouter:
+    """
+    Chooses the model of each LLM stage from a routing table like
+    `{"summary": {"model": "gpt-4", "fallback": "gpt-3.5-turbo", "latency_slo": 30}}`.
+    A stage uses its fallback model while the average latency of its calls to the primary model during
+    the last `window_seconds` is over `latency_slo` seconds. Once those latencies are older than the
+    window, the stage goes back to the primary model.
+    """
+
+    stages = ("job_parsing", "highlighter", "skills_matcher", "summary", "improver", "extractor")
+
+    def __init__(self, routes: dict = None, window_seconds: float = 300, min_samples: int = 3):
+        """
+        :param routes: Mapping of stage to its `model`, and optional `fallback` model and `latency_slo`
+        :param window_seconds: Age of the latencies taken into account
+        :param min_samples: Recent calls needed before a stage falls back
+        """
+        self.routes = routes or {}
+        unknown = set(self.routes) - set(self.stages)
+        if unknown:
+            raise ValueError(f"Unknown LLM stages in routes: {', '.join(sorted(unknown))}")
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self._latencies = {}
+        self._falling_back = set()
+        self._lock = threading.Lock()
+
+    def _rolling_latency(self, stage: str, model_name: str):
+        """Average latency of the recent calls, None if there are too few of them"""
+        expired_time = time.time() - self.window_seconds
+        with self._lock:
+            latencies = self._latencies.get((stage, model_name), collections.deque())
+            while latencies and latencies[0][0] < expired_time:
+                latencies.popleft()
+            if len(latencies) < self.min_samples:
+                return None
+            return sum(seconds for _, seconds in latencies) / len(latencies)
+
+    def model(self, stage: str, default: str) -> str:
+        """Model to use for the stage, `default` when the stage has no route"""
+        route = self.routes.get(stage, {})
+        primary = route.get("model", default)
+        fallback, slo = route.get("fallback"), route.get("latency_slo")
+        if not fallback or not slo:
+            return primary
+        latency = self._rolling_latency(stage, primary)
+        falling_back = latency is not None and latency > slo
+        with self._lock:
+            if falling_back != (stage in self._falling_back):
+                if falling_back:
+                    self._falling_back.add(stage)
+                    logger.warning(f"{stage}: {primary} latency {latency:.1f}s over {slo}s, using {fallback}")
+                else:
+                    self._falling_back.discard(stage)
+                    logger.info(f"{stage}: back to {primary}")
+        return fallback if falling_back else primary
+
+    def record(self, stage: str, model_name: str, seconds: float):
+        with self._lock:
+            self._latencies.setdefault((stage, model_name), collections.deque()).append((time.time(), seconds))
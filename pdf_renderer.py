@@ -0,0 +1,93 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import utils
+
+# create logger
+logger = logging.getLogger(__name__)
+
+# scratch directory of the current worker process
+_worker_dir = None
+
+
+def _init_worker(scratch_root: str = None):
+    global _worker_dir
+    _worker_dir = tempfile.mkdtemp(prefix=f"latex_{os.getpid()}_", dir=scratch_root)
+
+
+def _compile_in_worker(latex_string: str, name: str, timeout: float) -> bytes:
+    # the same name is reused for every run of a template, so latexmk can reuse its auxiliary files
+    jobname = os.path.join(_worker_dir, name)
+    tex_file = f"{jobname}.tex"
+    with open(tex_file, "wt", encoding="utf-8") as stream:
+        stream.write(latex_string)
+    pdf_file = utils.compile_latex(tex_file, jobname=jobname, timeout=timeout)
+    with open(pdf_file, "rb") as stream:
+        return stream.read()
+
+
+class PdfRenderer:
+    """
+    Renders resumes to PDF in a pool of worker processes.
+    Each worker compiles in its own scratch directory, so concurrent renders never share files.
+    The workers are started on the first compilation, with `spawn` so they don't inherit the threads and
+    Mongo connections of the app.
+    """
+
+    def __init__(self, max_workers: int = 2, timeout: float = 60, scratch_root: str = None):
+        """
+        :param max_workers: Number of LaTeX compilations run at the same time
+        :param timeout: Seconds after which a compilation is killed
+        :param scratch_root: Directory for the worker scratch directories, the system temp directory by default
+        """
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.scratch_root = scratch_root
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.scratch_root,),
+                )
+            return self._executor
+
+    def submit(self, data: dict, template_file: str = None) -> Future:
+        """Render the template in this process and queue its compilation, the future resolves to PDF bytes"""
+        if not template_file:
+            template_file = "resume.tex"
+        key = utils.render_key(data, template_file=template_file)
+        pdf = utils.render_cache.get(key, ".pdf")
+        if pdf is not None:
+            future = Future()
+            future.set_result(pdf)
+            return future
+
+        latex_string = utils.render_tex(data, template_file=template_file)
+        name, _ = os.path.splitext(os.path.basename(template_file))
+        future = self._get_executor().submit(_compile_in_worker, latex_string, name, self.timeout)
+        future.add_done_callback(lambda f: self._cache_pdf(key, f))
+        return future
+
+    @staticmethod
+    def _cache_pdf(key: str, future: Future):
+        if not future.cancelled() and future.exception() is None:
+            utils.render_cache.put(key, ".pdf", future.result())
+
+    def render(self, data: dict, template_file: str = None) -> bytes:
+        return self.submit(data, template_file=template_file).result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
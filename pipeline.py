@@ -1,7 +1,10 @@
+import functools
 import json
 import logging
 import os
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
 # from IPython.display import display, Markdown
@@ -16,22 +19,126 @@ from yaml_to_json import yaml_to_json
 logger = logging.getLogger(__name__)
 
 
+def timed_stage(name: str):
+    """
+    Record the wall time of a pipeline step in `Pipeline.stage_times` and emit its start and finish events.
+    Steps called from within another step are counted in the time of that step.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(self._running_stage, "name", None):
+                return method(self, *args, **kwargs)
+            self._running_stage.name = name
+            start_time = time.time()
+            self._emit(dict(event="stage_start", stage=name))
+            result = None
+            try:
+                result = method(self, *args, **kwargs)
+                return result
+            finally:
+                self._running_stage.name = None
+                self.stage_times[name] = time.time() - start_time
+                logger.info(f"Stage {name} done. Time Using: {self.stage_times[name]:.6f}")
+                self._emit(
+                    dict(event="stage_finish", stage=name, time=self.stage_times[name], result=result)
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def run_stages(stages: dict, max_workers: int = None) -> None:
+    """
+    Run a dependency graph of stages, starting each one as soon as all of its dependencies are done
+    :param stages: Mapping of stage name to a tuple of (callable, list of dependency names)
+    :param max_workers: Maximum number of stages running at the same time
+    """
+    remaining = dict(stages)
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as executor:
+        while remaining or running:
+            ready = [
+                name
+                for name, (_, dependencies) in remaining.items()
+                if all(d in done for d in dependencies)
+            ]
+            for name in ready:
+                func, _ = remaining.pop(name)
+                running[executor.submit(func)] = name
+            if not running:
+                raise ValueError(f"Stages with unresolvable dependencies: {list(remaining)}")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # re-raise the exception of a failed stage
+                future.result()
+                done.add(name)
+
+
 class Pipeline:
-    def __init__(self, root_path="my_applications", openai_model_name="gpt-3.5-turbo"):
+    def __init__(
+        self,
+        root_path="my_applications",
+        openai_model_name="gpt-3.5-turbo",
+        max_concurrency: int = 4,
+        use_llm_cache: bool = False,
+        persist: bool = True,
+        on_event=None,
+        token_budget: int = None,
+        model_router=None,
+    ):
         self.root_path: str = root_path
+        # write the parsed job and generated resume under `root_path`. Without it, stages only pass
+        # the artifacts in memory and no tex file is generated.
+        self.persist: bool = persist
+        # number of resume sections rewritten by the LLM in parallel
+        self.max_concurrency: int = max_concurrency
+        # maximum prompt tokens per chain, less relevant resume entries are left out to fit
+        self.token_budget: int = token_budget
         self.raw_job: str = ""
         self.raw_resume: dict = {}
         self.final_resume: dict = {}
         self.parsed_job: dict = {}
+        self.improvements: list = []
+        # LLM outputs of a previous run, reused for the sections whose inputs did not change
+        self.previous_outputs: dict = {}
+        # LLM outputs of this run keyed by a fingerprint of their inputs
+        self.section_outputs: dict = {}
         self.resume_builder = None
         self.resume_json: str = ""
         self.resume_filename: str = ""
         self.folder: str = ""
+        # wall time in seconds of each executed stage
+        self.stage_times: dict = {}
+        # called with a dict for each stage start and finish
+        self.on_event = on_event
+        # stage run by the current thread, stages run in parallel in different threads
+        self._running_stage = threading.local()
+        # retries of transient LLM errors, keyed by the name of the call
+        self.llm_retries: dict = {}
+        # prompt tokens of each LLM call, in lists keyed by the name of the chain output
+        self.prompt_tokens: dict = {}
+        # ModelRouter choosing the model of each stage, `openai_model_name` is used for all stages without it
+        self.model_router = model_router
         self.llm_kwargs = dict(
             model_name=openai_model_name,
             model_kwargs=dict(top_p=0.6, frequency_penalty=0.1),
+            # reuse cached answers for identical prompts instead of generating new outputs
+            cache=use_llm_cache,
         )
 
+    def _emit(self, event: dict):
+        if self.on_event:
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.error(f"Pipeline event handler failed: {e}")
+
     def set_raw_resume(self, raw_resume=None, filename: str = ""):
         if raw_resume is None:
             raw_resume = {}
@@ -56,6 +163,7 @@ class Pipeline:
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
 
+    @timed_stage("parse_job")
     def read_and_parse_job(self):
         print("=========== Start parsing job information ===========")
         if not self.raw_job and not self.parsed_job:
@@ -64,12 +172,13 @@ class Pipeline:
             )
             return None
 
-        start_time = time.time()
-
         if not self.parsed_job:
-            job_post = Job_Post(self.raw_job)
+            job_post = Job_Post(self.raw_job, retries=self.llm_retries, router=self.model_router)
             self.parsed_job = job_post.parse_job_post(verbose=False)
 
+        if not self.persist:
+            return None
+
         company_name = self.parsed_job["company"]
         job_title = self.parsed_job["job_title"].replace("/", "_")
         today_date = datetime.today().strftime("%Y%m%d")
@@ -83,14 +192,9 @@ class Pipeline:
 
         utils.write_yaml(self.parsed_job, filename=f"{self.resume_filename}.job")
 
-        print(
-            f"Step 1: Parsing Done: {self.resume_filename}. Time Using: {time.time() - start_time:.6f}"
-        )
-
+    @timed_stage("read_resume")
     def read_resume(self):
         print("=========== Start reading resume ===========")
-        start_time = time.time()
-
         if not self.parsed_job:
             self.read_and_parse_job()
         if not self.raw_resume:
@@ -101,12 +205,18 @@ class Pipeline:
             resume=self.raw_resume,
             parsed_job=self.parsed_job,
             llm_kwargs=self.llm_kwargs,
+            max_concurrency=self.max_concurrency,
+            previous_outputs=self.previous_outputs,
+            outputs=self.section_outputs,
+            token_budget=self.token_budget,
+            retries=self.llm_retries,
+            router=self.model_router,
+            prompt_tokens=self.prompt_tokens,
         )
-        print(f"Step 2: Read Resume Done. Time Using: {time.time() - start_time:.6f}")
 
+    @timed_stage("experiences")
     def update_experiences(self, update_yaml=False) -> str:
         print("=========== Start updating experiences ===========")
-        start_time = time.time()
         if not self.resume_builder:
             self.read_resume()
         experiences = self.resume_builder.rewrite_unedited_experiences(verbose=False)
@@ -114,14 +224,11 @@ class Pipeline:
         if update_yaml:
             experiences_yaml = utils.dict_to_yaml_string(dict(experiences=experiences))
             self.update_resume_data(experiences_yaml)
-        print(
-            f"Step 3: Update Experiences Done. Time Using: {time.time() - start_time:.6f}"
-        )
         return experiences
 
+    @timed_stage("projects")
     def update_projects(self, update_yaml=False) -> str:
         print("=========== Start updating projects ===========")
-        start_time = time.time()
         if not self.resume_builder:
             self.read_resume()
         projects = self.resume_builder.rewrite_projects_desc(verbose=False)
@@ -129,31 +236,25 @@ class Pipeline:
         if update_yaml:
             projects_yaml = utils.dict_to_yaml_string(dict(projects=projects))
             self.update_resume_data(projects_yaml)
-        print(
-            f"Step 4: Update Projects Done. Time Using: {time.time() - start_time:.6f}"
-        )
         return projects
 
+    @timed_stage("skills")
     def update_skills(self, update_yaml=False) -> str:
         """
         This will match the required skills from the job post with your resume sections
         Outputs a combined list of skills extracted from the job post and included in the raw resume
         """
         print("=========== Start extracting skills ===========")
-        start_time = time.time()
         skills = self.resume_builder.extract_matched_skills(verbose=False)
         self.resume_builder.skills = skills
         if update_yaml:
             skills_yaml = utils.dict_to_yaml_string(dict(skills=skills))
             self.update_resume_data(skills_yaml)
-        print(
-            f"Step 5: Extract Skills From Job Done. Time Using: {time.time() - start_time:.6f}"
-        )
         return skills
 
+    @timed_stage("summary")
     def update_summary(self, update_yaml=False) -> str:
         print("=========== Start updating summary ===========")
-        start_time = time.time()
         if not self.resume_builder:
             self.read_resume()
         summary = self.resume_builder.write_summary(verbose=True)
@@ -161,19 +262,18 @@ class Pipeline:
         if update_yaml:
             summary_yaml = utils.dict_to_yaml_string(dict(summary=summary))
             self.update_resume_data(summary_yaml)
-        print(
-            f"Step 6: Update Summary Done. Time Using: {time.time() - start_time:.6f}"
-        )
         return summary
 
+    @timed_stage("resume_yaml")
     def generate_resume_yaml(self):
-        if not self.parsed_job or not self.resume_filename:
+        if not self.parsed_job or (self.persist and not self.resume_filename):
             self.read_and_parse_job()
         if not self.resume_builder:
             self.read_resume()
 
         self.final_resume = self.resume_builder.finalize()
-        utils.write_yaml(self.final_resume, filename=f"{self.resume_filename}.yaml")
+        if self.persist:
+            utils.write_yaml(self.final_resume, filename=f"{self.resume_filename}.yaml")
 
     def update_resume_data(self, edits):
         # Review the generated output in previous cell.
@@ -199,37 +299,56 @@ class Pipeline:
         self.generate_resume_yaml()
         print(f"Successfully: {', '.join(updated)} updated successfully")
 
+    @timed_stage("improve")
     def improve_final_resume(self):
         print("=========== Start improving final resume ===========")
-        start_time = time.time()
-
-        if not self.resume_filename:
-            self.read_and_parse_job()
+        if self.persist:
+            if not self.resume_filename:
+                self.read_and_parse_job()
+            # read back the files, which may have been edited after they were generated
+            resume = utils.read_yaml(filename=f"{self.resume_filename}.yaml")
+            parsed_job = utils.read_yaml(filename=f"{self.resume_filename}.job")
+        else:
+            if not self.final_resume:
+                self.generate_resume_yaml()
+            resume = self.final_resume
+            parsed_job = self.parsed_job
 
         final_resume = Resume_Builder(
-            resume=utils.read_yaml(filename=f"{self.resume_filename}.yaml"),
-            parsed_job=utils.read_yaml(filename=f"{self.resume_filename}.job"),
+            resume=resume,
+            parsed_job=parsed_job,
             is_final=True,
             llm_kwargs=self.llm_kwargs,
+            previous_outputs=self.previous_outputs,
+            outputs=self.section_outputs,
+            token_budget=self.token_budget,
+            retries=self.llm_retries,
+            router=self.model_router,
+            prompt_tokens=self.prompt_tokens,
         )
         improvements = final_resume.suggest_improvements(verbose=True)
-        improvements_yaml = utils.dict_to_yaml_string(dict(improvements=improvements))
-        self.update_resume_data(improvements_yaml)
-        print(
-            f"Step 8: Improve Final Resume Done. Time Using: {time.time() - start_time:.6f}"
-        )
+        self.improvements = improvements
+        if self.persist:
+            improvements_yaml = utils.dict_to_yaml_string(dict(improvements=improvements))
+            self.update_resume_data(improvements_yaml)
 
+    @timed_stage("tex")
     def generate_tex(self):
         print("=========== Start generate tex ===========")
         utils.generate_new_tex(yaml_file=f"{self.resume_filename}.yaml")
 
+    @timed_stage("json")
     def generate_json(self):
-        resume_yaml = utils.read_yaml(filename=f"{self.resume_filename}.yaml")
+        if self.persist:
+            resume_yaml = utils.read_yaml(filename=f"{self.resume_filename}.yaml")
+        else:
+            resume_yaml = self.final_resume
         self.final_resume = yaml_to_json(resume_yaml)
 
-        # Write the data to the JSON file
-        with open(f"{self.resume_filename}.json", "w", encoding="utf-8") as json_file:
-            json.dump(self.final_resume, json_file)
+        if self.persist:
+            # Write the data to the JSON file
+            with open(f"{self.resume_filename}.json", "w", encoding="utf-8") as json_file:
+                json.dump(self.final_resume, json_file)
 
         print("Successfully generate json file.")
 
@@ -240,35 +359,40 @@ class Pipeline:
         pdf_file = utils.generate_pdf(yaml_file=f"{self.resume_filename}.yaml")
         # display(Markdown((f"[{pdf_file}](<{pdf_file}>)")))
 
-    def main(self):
-        # Step 1 - Read and parse job posting
-        self.read_and_parse_job()
-
-        # Step 2 - read raw resume and create Resume builder object
-        self.read_resume()
+    def _stages(self) -> dict:
+        """Pipeline steps mapped to the steps they depend on"""
+        stages = {
+            # Step 1 - Read and parse job posting
+            "parse_job": (self.read_and_parse_job, []),
+            # Step 2 - read raw resume and create Resume builder object
+            "read_resume": (self.read_resume, ["parse_job"]),
+            # Step 3 - Rephrase unedited experiences. Try re-running cells in case of missing answers or hallucinations.
+            "experiences": (self.update_experiences, ["read_resume"]),
+            # Step 4 - Rephrase projects
+            "projects": (self.update_projects, ["read_resume"]),
+            # Step 5 - Extract skills, matched against the rewritten experiences and projects
+            "skills": (self.update_skills, ["experiences", "projects"]),
+            # Step 6 - Create a resume summary, which includes the extracted skills
+            "summary": (self.update_summary, ["skills"]),
+            # Step 7 - Generate final resume yaml for review
+            "resume_yaml": (self.generate_resume_yaml, ["summary"]),
+            # Step 8 - Identify resume improvements
+            "improve": (self.improve_final_resume, ["resume_yaml"]),
+            # Step 9 - Generate tex and json from yaml
+            "tex": (self.generate_tex, ["improve"]),
+            "json": (self.generate_json, ["improve"]),
+        }
+        if not self.persist:
+            # the tex file is only written to disk
+            del stages["tex"]
+        return stages
 
-        # Step 3 - Rephrase unedited experiences. Try re-running cells in case of missing answers or hallucinations.
-        self.update_experiences()
-
-        # Step 4 - Rephrase projects
-        self.update_projects()
-
-        # Step 5 - Extract skills
-        self.update_skills()
-
-        # Step 6 - Create a resume summary
-        self.update_summary()
-
-        # Step 7 - Generate final resume yaml for review
-        self.generate_resume_yaml()
-
-        # Step 8 - Identify resume improvements
-        self.improve_final_resume()
-
-        # Step 9 - Generate pdf from yaml
-        # generate_pdf(resume_filename)
-        self.generate_tex()
-        self.generate_json()
+    def main(self):
+        self.stage_times = {}
+        self.prompt_tokens.clear()
+        start_time = time.time()
+        run_stages(self._stages())
+        self.stage_times["total"] = time.time() - start_time
 
 
 def read_json(filename: str) -> dict:
@@ -1,5 +1,10 @@
+import copy
+import functools
+import json
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List
 import time
@@ -9,7 +14,6 @@ import langchain
 from dateutil import parser as dateparser
 from dateutil.relativedelta import relativedelta
 from langchain import LLMChain
-from langchain.cache import InMemoryCache
 from langchain.chains.openai_functions import create_structured_output_chain
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import (
@@ -18,42 +22,186 @@ from langchain.prompts import (
     SystemMessagePromptTemplate,
 )
 from langchain.schema import HumanMessage, SystemMessage
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 
+import answer_parser
 import utils
-
-load_dotenv()
+from fake_llm import FakeChatModel
+from llm_cache import PersistentLLMCache
+from llm_hedge import Hedger
+from llm_retry import CircuitOpenError, call_with_retry, get_breaker, is_transient
+from model_router import ModelRouter
+from rate_governor import RateGovernor
+from token_counter import count_tokens, relevance
 
 # create logger
 logger = logging.getLogger(__name__)
 
-# confirm presence of openAI API key
-if "OPENAI_API_KEY" not in os.environ:
-    if os.getenv("OPENAI_API_KEY"):
-        os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-    else:
-        logger.info(
-            "OPENAI_API_KEY not found in environment. User will be prompted to enter their key."
+# chat models selectable with the LLM_BACKEND environment variable. `fake` runs offline.
+CHAT_MODELS = {"openai": ChatOpenAI, "fake": FakeChatModel}
+
+_setup_done = False
+_setup_lock = threading.Lock()
+
+# Settings of the LLM calls, overridden with configure_llm(), e.g. from the Flask config
+llm_settings = dict(
+    # requests and tokens per minute of all processes, unlimited when None
+    LLM_RPM=None,
+    LLM_TPM=None,
+    LLM_RATE_PATH="llm_rate.sqlite",
+    # seconds before a request is given up, and retries of transient errors
+    LLM_REQUEST_TIMEOUT=60,
+    LLM_MAX_RETRIES=3,
+    # consecutive failures opening the circuit of a model, and seconds before it is tried again
+    LLM_BREAKER_FAILURES=5,
+    LLM_BREAKER_RESET_SECONDS=30,
+    # latency percentile after which a call is duplicated, no hedging when None
+    LLM_HEDGE_PERCENTILE=None,
+    LLM_HEDGE_MAX_RATIO=0.1,
+    LLM_HEDGE_MIN_SAMPLES=20,
+    # SQLite database of the LLM answers cached for all processes, seconds answers are kept, and its maximum size
+    LLM_CACHE_PATH="llm_cache.sqlite",
+    LLM_CACHE_TTL=7 * 24 * 3600,
+    LLM_CACHE_MAX_BYTES=256 * 1024 * 1024,
+    # ask for OPENAI_API_KEY when it is not set, in notebooks and scripts. A server fails the call instead.
+    LLM_PROMPT_API_KEY=True,
+)
+
+# requests and tokens per minute shared by all processes, set up when LLM_RPM or LLM_TPM is set
+rate_governor = None
+# duplicates slow LLM calls when LLM_HEDGE_PERCENTILE is set
+hedger = None
+# completion tokens assumed by the rate governor when the call sets no `max_tokens`
+EXPECTED_COMPLETION_TOKENS = 512
+
+
+def configure_llm(**settings):
+    """Override `llm_settings`. The LLM cache, rate governor and hedger are set up again with the new settings."""
+    unknown = set(settings) - set(llm_settings)
+    if unknown:
+        raise ValueError(f"Unknown LLM settings: {', '.join(sorted(unknown))}")
+    with _setup_lock:
+        llm_settings.update(settings)
+        if _setup_done:
+            _setup_cache()
+            _setup_call_layer()
+    # clients created with the previous settings are not rate limited or timed out as configured
+    with _llm_pool_lock:
+        _llm_pool.clear()
+
+
+def _setup_cache():
+    # persisted on disk and shared by all processes
+    langchain.llm_cache = PersistentLLMCache(
+        database_path=llm_settings["LLM_CACHE_PATH"],
+        ttl=llm_settings["LLM_CACHE_TTL"],
+        max_bytes=llm_settings["LLM_CACHE_MAX_BYTES"],
+    )
+
+
+def _setup_call_layer():
+    global rate_governor, hedger
+    rate_governor = None
+    if llm_settings["LLM_RPM"] or llm_settings["LLM_TPM"]:
+        rate_governor = RateGovernor(
+            database_path=llm_settings["LLM_RATE_PATH"],
+            requests_per_minute=llm_settings["LLM_RPM"],
+            tokens_per_minute=llm_settings["LLM_TPM"],
         )
-        prompt = "Enter your OpenAI API key:"
-        os.environ["OPENAI_API_KEY"] = input(prompt)
+    hedger = None
+    if llm_settings["LLM_HEDGE_PERCENTILE"]:
+        hedger = Hedger(
+            percentile=llm_settings["LLM_HEDGE_PERCENTILE"],
+            max_hedge_ratio=llm_settings["LLM_HEDGE_MAX_RATIO"],
+            min_samples=llm_settings["LLM_HEDGE_MIN_SAMPLES"],
+        )
+
+
+def setup_llm():
+    """Load the environment, API key and LLM cache once, before the first LLM client is created"""
+    global _setup_done
+    with _setup_lock:
+        if _setup_done:
+            return
+        load_dotenv()
+
+        # confirm presence of openAI API key
+        if os.getenv("LLM_BACKEND", "openai") == "openai" and "OPENAI_API_KEY" not in os.environ:
+            if not llm_settings["LLM_PROMPT_API_KEY"]:
+                # nobody can answer a prompt in a server, it would block or fail with an unrelated EOFError
+                raise RuntimeError("OPENAI_API_KEY is not set, add it to the environment or the .env file")
+            logger.info(
+                "OPENAI_API_KEY not found in environment. User will be prompted to enter their key."
+            )
+            prompt = "Enter your OpenAI API key:"
+            os.environ["OPENAI_API_KEY"] = input(prompt)
+
+        # Set up LLM cache
+        _setup_cache()
 
-# Set up LLM cache
-langchain.llm_cache = InMemoryCache()
+        # Set up the rate limits, shared by all processes like the cache, and hedging
+        _setup_call_layer()
+        _setup_done = True
+
+
+@functools.lru_cache(maxsize=None)
+def governed(chat_model):
+    """Subclass of the chat model waiting for the rate governor before each call that is not cached"""
+
+    class GovernedChatModel(chat_model):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            prompt = "\n".join(m.content for m in messages) + json.dumps(kwargs.get("functions", ""))
+            estimated_tokens = count_tokens(prompt, self.model_name) + (
+                getattr(self, "max_tokens", None) or EXPECTED_COMPLETION_TOKENS
+            )
+            rate_governor.acquire(estimated_tokens, scope=self.model_name)
+            result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            token_usage = (result.llm_output or {}).get("token_usage", {})
+            if "total_tokens" in token_usage:
+                rate_governor.settle(token_usage["total_tokens"] - estimated_tokens, scope=self.model_name)
+            return result
+
+    GovernedChatModel.__name__ = f"Governed{chat_model.__name__}"
+    return GovernedChatModel
 
 
 def create_llm(**kwargs):
+    setup_llm()
     # set LLM provider
-    chat_model = kwargs.pop("chat_model", ChatOpenAI)
+    chat_model = kwargs.pop("chat_model", CHAT_MODELS[os.getenv("LLM_BACKEND", "openai")])
+    if chat_model is FakeChatModel and "latency" not in kwargs:
+        kwargs["latency"] = float(os.getenv("FAKE_LLM_LATENCY", 0))
+    if chat_model is FakeChatModel and "failure_rate" not in kwargs:
+        kwargs["failure_rate"] = float(os.getenv("FAKE_LLM_FAILURE_RATE", 0))
     # set default model
     if "model_name" not in kwargs:
         kwargs["model_name"] = "gpt-3.5-turbo"
     # set default cache to False so reruns generate new outputs
     if "cache" not in kwargs:
         kwargs["cache"] = False
+    if issubclass(chat_model, ChatOpenAI):
+        # give up on hanging requests, retries are made by the callers so they can be counted
+        kwargs.setdefault("request_timeout", llm_settings["LLM_REQUEST_TIMEOUT"])
+        kwargs.setdefault("max_retries", 0)
+    if rate_governor is not None:
+        chat_model = governed(chat_model)
     return chat_model(**kwargs)
 
 
+# LLM clients shared by all chains, keyed by a fingerprint of their settings
+_llm_pool = {}
+_llm_pool_lock = threading.Lock()
+
+
+def get_llm(**kwargs):
+    """Return the shared LLM client for these settings, so concurrent calls reuse its HTTP connections"""
+    key = utils.fingerprint(kwargs)
+    with _llm_pool_lock:
+        if key not in _llm_pool:
+            _llm_pool[key] = create_llm(**kwargs)
+        return _llm_pool[key]
+
+
 def format_list_as_string(l: list, list_sep: str = "\n- ") -> str:
     if isinstance(l, list):
         return list_sep + list_sep.join(l)
@@ -74,7 +222,6 @@ def parse_date(d: str) -> datetime:
     try:
         return dateparser.parse(str(d), default=default_date)
     except dateparser._parser.ParserError as e:
-        langchain.llm_cache.clear()
         logger.error(f"Date input `{d}` could not be parsed.")
         raise e
 
@@ -132,6 +279,14 @@ class Job_Skills(BaseModel):
     )
 
 
+class Job_Posting(Job_Description, Job_Skills):
+    """Description and skills of a job posting"""
+
+
+# Fields of a parsed job post
+JOB_POST_FIELDS = list(Job_Posting.__fields__)
+
+
 # Pydantic class that defines each highlight to be returned by the LLM
 class Resume_Section_Highlight(BaseModel):
     highlight: str = Field(..., description="one highlight")
@@ -208,16 +363,70 @@ class Resume_Improver_Output(BaseModel):
 
 
 class Extractor_LLM:
-    def __init__(self):
-        # The extractor LLM is hard-coded to the cheaper gpt3.5 model
-        self.extractor_llm = create_llm(
-            chat_model=ChatOpenAI,
-            model_name="gpt-3.5-turbo",
+    # extractor chains shared by all instances, keyed by LLM client, output format and chain arguments
+    _extractor_chains = {}
+
+    _retries_lock = threading.Lock()
+    # stage of the model router used for the extractor calls
+    extractor_stage = "extractor"
+
+    def __init__(self, retries: dict = None, router: ModelRouter = None):
+        # retries of transient LLM errors, keyed by the name of the call
+        self.retries = retries if retries is not None else {}
+        # chooses the model of each stage, the default models are used without it
+        self.router = router
+
+    def _model(self, stage: str, default: str) -> str:
+        return self.router.model(stage, default) if self.router else default
+
+    def _extractor_llm(self):
+        # The extractor LLM defaults to the cheaper gpt3.5 model
+        return get_llm(
+            model_name=self._model(self.extractor_stage, "gpt-3.5-turbo"),
             temperature=0.3,
             cache=True,
         )
 
-    def _extractor_chain(self, pydantic_object, **chain_kwargs) -> LLMChain:
+    def _count_retry(self, name: str):
+        with self._retries_lock:
+            self.retries[name] = self.retries.get(name, 0) + 1
+
+    def _call_llm(self, name: str, stage: str, llm, function):
+        """
+        Call the LLM through `function`, retrying transient errors and failing fast while it is down.
+        With hedging set up, each attempt is duplicated when it is slower than usual for `name`.
+        The latency of each successful attempt is reported to the model router of the stage.
+        """
+        call = function
+        if hedger is not None:
+            call = functools.partial(hedger.call, name, function)
+
+        def attempt():
+            start_time = time.time()
+            result = call()
+            # failed calls and retry backoffs say nothing about how fast the model answers
+            if self.router:
+                self.router.record(stage, llm.model_name, time.time() - start_time)
+            return result
+
+        return self._call_with_retry(name, llm, attempt)
+
+    def _call_with_retry(self, name: str, llm, attempt):
+        return call_with_retry(
+            attempt,
+            max_retries=llm_settings["LLM_MAX_RETRIES"],
+            breaker=get_breaker(
+                llm.model_name,
+                failure_threshold=llm_settings["LLM_BREAKER_FAILURES"],
+                reset_seconds=llm_settings["LLM_BREAKER_RESET_SECONDS"],
+            ),
+            on_retry=lambda attempt, error: self._count_retry(name),
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _extractor_prompt() -> ChatPromptTemplate:
+        """Prompt template built once and shared by all instances"""
         prompt_msgs = [
             SystemMessage(
                 content="You are a world class algorithm for extracting information in structured formats."
@@ -228,40 +437,67 @@ class Extractor_LLM:
             HumanMessagePromptTemplate.from_template("{input}"),
             HumanMessage(content="Tips: Make sure to answer in the correct format."),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        return create_structured_output_chain(
-            pydantic_object, llm=self.extractor_llm, prompt=prompt, **chain_kwargs
-        )
+    def _extractor_chain(self, llm, pydantic_object, **chain_kwargs) -> LLMChain:
+        key = (id(llm), pydantic_object, tuple(sorted(chain_kwargs.items())))
+        if key not in self._extractor_chains:
+            self._extractor_chains[key] = create_structured_output_chain(
+                pydantic_object, llm=llm, prompt=self._extractor_prompt(), **chain_kwargs
+            )
+        return self._extractor_chains[key]
 
     def extract_from_input(self, pydantic_object, input: str, **chain_kwargs) -> dict:
+        llm = self._extractor_llm()
+        chain = self._extractor_chain(llm, pydantic_object=pydantic_object, **chain_kwargs)
         try:
-            return (
-                self._extractor_chain(pydantic_object=pydantic_object, **chain_kwargs)
-                    .predict(input=input)
+            return self._call_llm(
+                f"extract_{pydantic_object.__name__}",
+                self.extractor_stage,
+                llm,
+                lambda: chain.predict(input=input),
             )
         except Exception as e:
-            print("Encountered exception during parsing input. See below:")
-            print(e)
+            # an unavailable LLM fails the task, instead of finishing it with empty sections
+            if isinstance(e, CircuitOpenError) or is_transient(e):
+                raise
+            logger.error(f"Encountered exception during parsing input: {e}")
 
 
 class Job_Post(Extractor_LLM):
-    def __init__(self, posting: str):
-        super().__init__()
+    extractor_stage = "job_parsing"
+
+    def __init__(self, posting: str, retries: dict = None, router: ModelRouter = None):
+        super().__init__(retries=retries, router=router)
         self.posting = posting
         self.parsed_job = None
 
-    def parse_job_post(self, **chain_kwargs) -> dict:
-        parsed_job = self.extract_from_input(
-            pydantic_object=Job_Description, input=self.posting, **chain_kwargs
-        )
-        job_skills = self.extract_from_input(
-            pydantic_object=Job_Skills,
-            input=self.posting,
-            **chain_kwargs,
-        )
+    def parse_job_post(self, single_call: bool = True, **chain_kwargs) -> dict:
+        """
+        Extract the job description and skills from the posting.
+        With `single_call`, both are extracted in one call using the combined `Job_Posting` schema,
+        falling back to concurrent `Job_Description` and `Job_Skills` calls if the answer is invalid.
+        """
+        if single_call:
+            parsed_job = self.extract_from_input(
+                pydantic_object=Job_Posting, input=self.posting, **chain_kwargs
+            )
+            try:
+                Job_Posting.parse_obj(parsed_job)
+                self.parsed_job = parsed_job
+                return self.parsed_job
+            except ValidationError as e:
+                logger.warning(f"Combined job post parsing failed, falling back to separate calls: {e}")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            parsed_job, job_skills = executor.map(
+                lambda pydantic_object: self.extract_from_input(
+                    pydantic_object=pydantic_object, input=self.posting, **chain_kwargs
+                ),
+                [Job_Description, Job_Skills],
+            )
         if parsed_job or job_skills:
-            self.parsed_job = parsed_job | job_skills
+            self.parsed_job = (parsed_job or {}) | (job_skills or {})
         else:
             print('parsed_job and job_skills are empty!')
         return self.parsed_job
@@ -274,12 +510,29 @@ class Resume_Builder(Extractor_LLM):
             parsed_job: dict,
             is_final: bool = False,
             llm_kwargs: dict = dict(),
+            max_concurrency: int = 1,
+            previous_outputs: dict = None,
+            outputs: dict = None,
+            token_budget: int = None,
+            retries: dict = None,
+            router: ModelRouter = None,
+            prompt_tokens: dict = None,
     ):
-        super().__init__()
+        super().__init__(retries=retries, router=router)
 
         self.resume = resume
         self.parsed_job = parsed_job
         self.llm_kwargs = llm_kwargs
+        # maximum number of sections rewritten by the LLM at the same time
+        self.max_concurrency = max(1, max_concurrency)
+        # chain outputs keyed by a fingerprint of their inputs: the ones of a previous run are reused
+        # instead of calling the LLM again, and the ones of this run are collected in `outputs`
+        self.previous_outputs = previous_outputs if previous_outputs is not None else {}
+        self.outputs = outputs if outputs is not None else {}
+        # maximum prompt tokens of a chain, the least relevant resume entries are left out to fit
+        self.token_budget = token_budget
+        # prompt tokens of each call, in lists keyed by the name of the chain output
+        self.prompt_tokens = prompt_tokens if prompt_tokens is not None else {}
 
         self.degrees = self._get_degrees(self.resume)
         self.basic_info = {
@@ -305,7 +558,10 @@ class Resume_Builder(Extractor_LLM):
             self.summary_raw = self.summary
             self.summary = ""
 
-    def _section_highlighter_chain(self, **chain_kwargs) -> LLMChain:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _section_highlighter_prompt() -> ChatPromptTemplate:
+        """Prompt template built once and shared by all instances"""
         prompt_msgs = [
             SystemMessage(
                 content=(
@@ -350,17 +606,20 @@ class Resume_Builder(Extractor_LLM):
                 )
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
+    def _section_highlighter_chain(self, **chain_kwargs) -> LLMChain:
         return LLMChain(
-            llm=llm,
-            prompt=prompt,
+            llm=get_llm(**self._stage_llm_kwargs("highlighter")),
+            prompt=self._section_highlighter_prompt(),
             return_final_only=False,
             **chain_kwargs,
         )
 
-    def _skills_matcher_chain(self, **chain_kwargs) -> LLMChain:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _skills_matcher_prompt() -> ChatPromptTemplate:
+        """Prompt template built once and shared by all instances"""
         prompt_msgs = [
             SystemMessage(
                 content=(
@@ -402,17 +661,20 @@ class Resume_Builder(Extractor_LLM):
                 )
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
+    def _skills_matcher_chain(self, **chain_kwargs) -> LLMChain:
         return LLMChain(
-            llm=llm,
-            prompt=prompt,
+            llm=get_llm(**self._stage_llm_kwargs("skills_matcher")),
+            prompt=self._skills_matcher_prompt(),
             return_final_only=False,
             **chain_kwargs,
         )
 
-    def _summary_writer_chain(self, **chain_kwargs) -> LLMChain:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _summary_writer_prompt() -> ChatPromptTemplate:
+        """Prompt template built once and shared by all instances"""
         prompt_msgs = [
             SystemMessage(
                 content=(
@@ -466,17 +728,20 @@ class Resume_Builder(Extractor_LLM):
                 )
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
+    def _summary_writer_chain(self, **chain_kwargs) -> LLMChain:
         return LLMChain(
-            llm=llm,
-            prompt=prompt,
+            llm=get_llm(**self._stage_llm_kwargs("summary")),
+            prompt=self._summary_writer_prompt(),
             return_final_only=False,
             **chain_kwargs,
         )
 
-    def _improver_chain(self, **chain_kwargs) -> LLMChain:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _improver_prompt() -> ChatPromptTemplate:
+        """Prompt template built once and shared by all instances"""
         prompt_msgs = [
             SystemMessage(
                 content=(
@@ -520,12 +785,12 @@ class Resume_Builder(Extractor_LLM):
                 )
             ),
         ]
-        prompt = ChatPromptTemplate(messages=prompt_msgs)
+        return ChatPromptTemplate(messages=prompt_msgs)
 
-        llm = create_llm(**self.llm_kwargs)
+    def _improver_chain(self, **chain_kwargs) -> LLMChain:
         return LLMChain(
-            llm=llm,
-            prompt=prompt,
+            llm=get_llm(**self._stage_llm_kwargs("improver")),
+            prompt=self._improver_prompt(),
             return_final_only=False,
             **chain_kwargs,
         )
@@ -626,6 +891,85 @@ class Resume_Builder(Extractor_LLM):
             message += "\nChain output:\n" + chain_output_unformatted
         # print(message)
 
+    def _stage_llm_kwargs(self, stage: str) -> dict:
+        """LLM settings of the stage, with the model chosen by the router"""
+        default = self.llm_kwargs.get("model_name", "gpt-3.5-turbo")
+        return {**self.llm_kwargs, "model_name": self._model(stage, default)}
+
+    def _run_chain(self, chain: LLMChain, chain_inputs: dict, pydantic_object, stage: str) -> dict:
+        """
+        Run the chain and extract its output in the format of `pydantic_object`.
+        The output of a previous run with the same inputs is reused when available.
+        """
+        key = utils.fingerprint(
+            dict(
+                output=pydantic_object.__name__,
+                inputs=chain_inputs,
+                llm={**self.llm_kwargs, "model_name": chain.llm.model_name},
+            )
+        )
+        if key in self.previous_outputs:
+            # keep reused outputs, so they can be reused by the next run too
+            self.outputs[key] = self.previous_outputs[key]
+            return copy.deepcopy(self.previous_outputs[key])
+
+        tokens = self._count_prompt_tokens(chain, chain_inputs)
+        self.prompt_tokens.setdefault(pydantic_object.__name__, []).append(tokens)
+        logger.info(f"{pydantic_object.__name__} prompt: {tokens} tokens")
+
+        output_unformatted = self._call_llm(
+            pydantic_object.__name__, stage, chain.llm, lambda: chain.predict(**chain_inputs)
+        )
+        # if "verbose" in chain_kwargs and chain_kwargs["verbose"]:
+        #     print("Chain output:\n" + output_unformatted)
+        # Parse the <Final Answer> locally, and only ask the extractor LLM when it is not understood
+        output = answer_parser.parse_answer(output_unformatted, pydantic_object)
+        answer_parser.record(parsed_locally=output is not None)
+        if output is None:
+            logger.info(f"{pydantic_object.__name__} not parsed locally, using the extractor LLM")
+            output = self.extract_from_input(
+                pydantic_object=pydantic_object, input=output_unformatted
+            )
+        if output and "final_answer" in output:
+            self.outputs[key] = copy.deepcopy({"final_answer": output["final_answer"]})
+        return output
+
+    def _count_prompt_tokens(self, chain: LLMChain, chain_inputs: dict) -> int:
+        prompt = chain.prompt.format(**chain_inputs)
+        return count_tokens(prompt, model_name=chain.llm.model_name)
+
+    def _job_keywords(self) -> set:
+        skills = self.parsed_job.get("technical_skills", []) + self.parsed_job.get("non_technical_skills", [])
+        return {s.lower() for s in skills}
+
+    def _fit_to_budget(self, chain: LLMChain, format_inputs, sections: dict) -> dict:
+        """
+        Format the chain inputs from the resume `sections`, leaving out the entries least relevant to the
+        job until the prompt fits in `token_budget`. At least one entry of each section is kept.
+        :param format_inputs: Function formatting the chain inputs from a dict of section entries
+        :param sections: Mapping of section name to its list of entries
+        """
+        chain_inputs = format_inputs(sections)
+        if not self.token_budget:
+            return chain_inputs
+
+        keywords = self._job_keywords()
+        sections = {name: list(entries or []) for name, entries in sections.items()}
+        while self._count_prompt_tokens(chain, chain_inputs) > self.token_budget:
+            candidates = [
+                (relevance(entry, keywords), name, i)
+                for name, entries in sections.items() if len(entries) > 1
+                for i, entry in enumerate(entries)
+            ]
+            if not candidates:
+                logger.warning(f"Prompt exceeds the budget of {self.token_budget} tokens.")
+                break
+            # ties are broken by dropping the last entries first
+            _, name, i = min(candidates, key=lambda c: (c[0], -c[2]))
+            del sections[name][i]
+            chain_inputs = format_inputs(sections)
+        return chain_inputs
+
     def rewrite_section(self, section: list or str, **chain_kwargs) -> dict:
         chain = self._section_highlighter_chain(**chain_kwargs)
         chain_inputs = format_prompt_inputs_as_strings(
@@ -633,15 +977,10 @@ class Resume_Builder(Extractor_LLM):
             **self.parsed_job,
             section=section,
         )
-        section_revised_unformatted = chain.predict(**chain_inputs)
-        # if "verbose" in chain_kwargs and chain_kwargs["verbose"]:
-        #     print("Chain output:\n" + section_revised_unformatted)
-        section_revised = self.extract_from_input(
-            pydantic_object=Resume_Section_Highlighter_Output,
-            input=section_revised_unformatted,
+        section_revised = self._run_chain(
+            chain, chain_inputs, pydantic_object=Resume_Section_Highlighter_Output, stage="highlighter"
         )
         if not section_revised or "final_answer" not in section_revised:
-            # self._print_debug_message(chain_kwargs, section_revised_unformatted)
             return None
         # sort section based on relevance in descending order
         section_revised = sorted(
@@ -649,50 +988,64 @@ class Resume_Builder(Extractor_LLM):
         )
         return [s["highlight"] for s in section_revised]
 
+    def rewrite_sections(self, sections: list, **chain_kwargs) -> list:
+        """Rewrite several sections, running up to `max_concurrency` chains at once.
+        Results are returned in the same order as `sections`."""
+        if self.max_concurrency == 1 or len(sections) <= 1:
+            return [self.rewrite_section(section=s, **chain_kwargs) for s in sections]
+        max_workers = min(self.max_concurrency, len(sections))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    lambda s: self.rewrite_section(section=s, **chain_kwargs), sections
+                )
+            )
+
     def rewrite_unedited_experiences(self, **chain_kwargs) -> dict:
         result = []
-        for exp_raw in self.experiences_raw:
+        unedited = {}
+        for i, exp_raw in enumerate(self.experiences_raw):
             # create copy of raw experience to update
             exp = dict(exp_raw)
             if exp.get("unedited", False):
                 experience_unedited = exp.get("summary", None)
-            else:
-                experience_unedited = ""
-            start_time = time.time()
-            print(f"{exp['name']} Start: \n {experience_unedited}")
-            if experience_unedited:
-                # rewrite experience using llm
-                exp["highlights"] = self.rewrite_section(
-                    section=experience_unedited, **chain_kwargs
-                )
+                if experience_unedited:
+                    unedited[i] = experience_unedited
             result.append(exp)
-            print(f"{exp['name']} End {time.time() - start_time:.6f}: \n {exp['highlights']}")
+
+        start_time = time.time()
+        # rewrite experiences using llm
+        highlights = self.rewrite_sections(list(unedited.values()), **chain_kwargs)
+        for i, exp_highlights in zip(unedited, highlights):
+            result[i]["highlights"] = exp_highlights
+            logger.info(f"{result[i]['name']} End: \n {exp_highlights}")
+        logger.info(f"Rewrite {len(unedited)} experiences End {time.time() - start_time:.6f}")
 
         return result
 
     def rewrite_projects_desc(self, **chain_kwargs) -> dict:
         result = []
-        for proj_raw in self.projects_raw:
+        unedited = {}
+        for i, proj_raw in enumerate(self.projects_raw):
             # create copy of raw project desc to update
             proj = proj_raw
             if not isinstance(proj_raw, dict):
                 proj = dict(proj_raw)
-            start_time = time.time()
 
             if proj.get("unedited", False):
                 proj_unedited = proj.get("summary", None)
-            else:
-                proj_unedited = ""
-
-            if proj_unedited:
-                skills = proj['skills']
-                desc_combined = proj_unedited + " using " + skills
-                # rewrite project desc using llm
-                proj["highlights"] = self.rewrite_section(
-                    section=desc_combined, **chain_kwargs
-                )
+                if proj_unedited:
+                    skills = proj['skills']
+                    unedited[i] = proj_unedited + " using " + skills
             result.append(proj)
-            print(f"{proj['title']} End {time.time() - start_time:.6f}: \n {proj['highlights']}")
+
+        start_time = time.time()
+        # rewrite project desc using llm
+        highlights = self.rewrite_sections(list(unedited.values()), **chain_kwargs)
+        for i, proj_highlights in zip(unedited, highlights):
+            result[i]["highlights"] = proj_highlights
+            logger.info(f"{result[i]['title']} End: \n {proj_highlights}")
+        logger.info(f"Rewrite {len(unedited)} projects End {time.time() - start_time:.6f}")
 
         return result
 
@@ -700,22 +1053,23 @@ class Resume_Builder(Extractor_LLM):
         chain = self._skills_matcher_chain(**chain_kwargs)
         # We don't use the skills provided in raw resume because the LLM focuses too much n them
         # Instead we will combine those skills with the ones extracted by the LLM
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.parsed_job,
-            degrees=self.degrees,
-            experiences=self._format_experiences_for_prompt(),
-            projects=self._format_projects_for_prompt,
+        chain_inputs = self._fit_to_budget(
+            chain,
+            lambda sections: format_prompt_inputs_as_strings(
+                prompt_inputs=chain.prompt.input_variables,
+                **self.parsed_job,
+                degrees=self.degrees,
+                **sections,
+            ),
+            dict(
+                experiences=self._format_experiences_for_prompt(),
+                projects=self._format_projects_for_prompt(),
+            ),
         )
-        extracted_skills_unformatted = chain.predict(**chain_inputs)
-        # if "verbose" in chain_kwargs and chain_kwargs["verbose"]:
-        #     print("Chain output:\n" + extracted_skills_unformatted)
-        extracted_skills = self.extract_from_input(
-            pydantic_object=Resume_Skills_Matcher_Output,
-            input=extracted_skills_unformatted,
+        extracted_skills = self._run_chain(
+            chain, chain_inputs, pydantic_object=Resume_Skills_Matcher_Output, stage="skills_matcher"
         )
         if not extracted_skills or "final_answer" not in extracted_skills:
-            # self._print_debug_message(chain_kwargs, extracted_skills_unformatted)
             return None
         extracted_skills = extracted_skills["final_answer"]
         result = []
@@ -736,44 +1090,46 @@ class Resume_Builder(Extractor_LLM):
 
     def write_summary(self, **chain_kwargs) -> dict:
         chain = self._summary_writer_chain(**chain_kwargs)
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.parsed_job,
-            degrees=self.degrees,
-            projects=self._format_projects_for_prompt(),
-            experiences=self._format_experiences_for_prompt(),
-            skills=self._format_skills_for_prompt(self.skills),
+        chain_inputs = self._fit_to_budget(
+            chain,
+            lambda sections: format_prompt_inputs_as_strings(
+                prompt_inputs=chain.prompt.input_variables,
+                **self.parsed_job,
+                degrees=self.degrees,
+                skills=self._format_skills_for_prompt(self.skills),
+                **sections,
+            ),
+            dict(
+                projects=self._format_projects_for_prompt(),
+                experiences=self._format_experiences_for_prompt(),
+            ),
         )
-        summary_unformatted = chain.predict(**chain_inputs)
-        # if "verbose" in chain_kwargs and chain_kwargs["verbose"]:
-        #     print("Chain output:\n" + summary_unformatted)
-        summary = self.extract_from_input(
-            pydantic_object=Resume_Summarizer_Output, input=summary_unformatted
+        summary = self._run_chain(
+            chain, chain_inputs, pydantic_object=Resume_Summarizer_Output, stage="summary"
         )
         if not summary or "final_answer" not in summary:
-            # self._print_debug_message(chain_kwargs, summary_unformatted)
             return None
         return summary["final_answer"]
 
     def suggest_improvements(self, **chain_kwargs) -> dict:
         chain = self._improver_chain(**chain_kwargs)
-        chain_inputs = format_prompt_inputs_as_strings(
-            prompt_inputs=chain.prompt.input_variables,
-            **self.parsed_job,
-            education=utils.dict_to_yaml_string(dict(Education=self.education)),
-            projects=utils.dict_to_yaml_string(dict(Projects=self.projects)),
-            summary=self.summary,
-            experiences=utils.dict_to_yaml_string(dict(Experiences=self.experiences)),
-            skills=utils.dict_to_yaml_string(dict(Skills=self.skills)),
+        chain_inputs = self._fit_to_budget(
+            chain,
+            lambda sections: format_prompt_inputs_as_strings(
+                prompt_inputs=chain.prompt.input_variables,
+                **self.parsed_job,
+                education=utils.dict_to_yaml_string(dict(Education=self.education)),
+                projects=utils.dict_to_yaml_string(dict(Projects=sections["projects"])),
+                summary=self.summary,
+                experiences=utils.dict_to_yaml_string(dict(Experiences=sections["experiences"])),
+                skills=utils.dict_to_yaml_string(dict(Skills=self.skills)),
+            ),
+            dict(projects=self.projects, experiences=self.experiences),
         )
-        improvements_unformatted = chain.predict(**chain_inputs)
-        # if "verbose" in chain_kwargs and chain_kwargs["verbose"]:
-        #     print("Chain output:\n" + improvements_unformatted)
-        improvements = self.extract_from_input(
-            pydantic_object=Resume_Improver_Output, input=improvements_unformatted
+        improvements = self._run_chain(
+            chain, chain_inputs, pydantic_object=Resume_Improver_Output, stage="improver"
         )
         if not improvements or "final_answer" not in improvements:
-            # self._print_debug_message(chain_kwargs, improvements_unformatted)
             return None
         return improvements["final_answer"]
 
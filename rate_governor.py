@@ -0,0 +1,118 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# create logger
+logger = logging.getLogger(__name__)
+
+
+class RateGovernor:
+    """
+    Token buckets limiting the LLM requests and tokens per minute of all threads and processes on the host.
+    The bucket levels are stored in a local SQLite database and updated in exclusive transactions.
+    Calls over the limit wait until the buckets refill instead of failing, so the aggregate throughput
+    stays at the provider limit. Buckets hold `burst_seconds` of their rate, which keeps bursts short.
+    """
+
+    def __init__(
+        self,
+        database_path: str = "llm_rate.sqlite",
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: float = 10,
+        max_sleep: float = 1,
+    ):
+        """
+        :param requests_per_minute: Request limit, unlimited when None
+        :param tokens_per_minute: Limit of the estimated prompt and completion tokens, unlimited when None
+        :param max_sleep: Longest sleep between two checks of the buckets
+        """
+        self.database_path = database_path
+        self.rates = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.burst_seconds = burst_seconds
+        self.max_sleep = max_sleep
+        self.stats = {"calls": 0, "throttled": 0, "wait_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_bucket ("
+                "name TEXT PRIMARY KEY, "
+                "level REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent read-modify-writes are serialized
+        conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _take(self, scope: str, amounts: dict, force: bool = False) -> float:
+        """
+        Take the amounts from the buckets of the scope if all of them have enough left.
+        :return: Seconds to wait before the amounts are available, 0 when they were taken
+        """
+        limits = [(name, amount, self.rates[name]) for name, amount in amounts.items() if self.rates[name]]
+        if not limits:
+            return 0
+        now = time.time()
+        wait = 0
+        with self._transaction() as conn:
+            levels = {}
+            for name, amount, rate in limits:
+                capacity = rate * self.burst_seconds / 60
+                row = conn.execute(
+                    "SELECT level, updated_at FROM rate_bucket WHERE name = ?", (f"{scope}:{name}",)
+                ).fetchone()
+                level = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate / 60)
+                levels[name] = level
+                # a call larger than the bucket is let through once the bucket is full
+                needed = min(amount, capacity)
+                if not force and level < needed:
+                    wait = max(wait, (needed - level) * 60 / rate)
+            for name, amount, rate in limits:
+                level = levels[name] - (amount if wait == 0 else 0)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_bucket (name, level, updated_at) VALUES (?, ?, ?)",
+                    (f"{scope}:{name}", level, now),
+                )
+        return wait
+
+    def acquire(self, tokens: int, scope: str = "default") -> float:
+        """
+        Block until a request of `tokens` estimated tokens fits in the limits of the scope.
+        :return: Seconds waited
+        """
+        start_time = time.time()
+        wait = self._take(scope, {"requests": 1, "tokens": tokens})
+        while wait > 0:
+            # jitter keeps waiting callers from checking the buckets in lockstep
+            time.sleep(min(wait, self.max_sleep) * random.uniform(1, 1.2))
+            wait = self._take(scope, {"requests": 1, "tokens": tokens})
+        waited = time.time() - start_time
+        with self._stats_lock:
+            self.stats["calls"] += 1
+            if waited > 0.01:
+                self.stats["throttled"] += 1
+                self.stats["wait_seconds"] += waited
+        if waited > 1:
+            logger.info(f"LLM call to {scope} waited {waited:.1f}s for the rate limit")
+        return waited
+
+    def settle(self, tokens: int, scope: str = "default") -> None:
+        """Correct the token bucket of the scope by the difference between the used and estimated tokens"""
+        if tokens:
+            self._take(scope, {"tokens": tokens}, force=True)
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Optional
+
+# create logger
+logger = logging.getLogger(__name__)
+
+
+class RenderCache:
+    """
+    Disk cache of rendered TeX and PDF files, keyed by a hash of the template source and the resume data.
+    The least recently used files are evicted once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory: str = ".render_cache", max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(template_source: str, data: dict) -> str:
+        content = json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha256(f"{template_source}\n{content}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}{ext}")
+
+    def get(self, key: str, ext: str) -> Optional[bytes]:
+        path = self._path(key, ext)
+        try:
+            with open(path, "rb") as stream:
+                content = stream.read()
+            # the modification time orders files for eviction
+            os.utime(path)
+            return content
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, ext: str, content: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first, so other processes never read a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as stream:
+            stream.write(content)
+        os.replace(temp_path, self._path(key, ext))
+        self._evict()
+
+    def _evict(self) -> None:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
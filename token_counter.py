@@ -0,0 +1,42 @@
+import functools
+import logging
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# create logger
+logger = logging.getLogger(__name__)
+
+# rough number of characters per token of English text, used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model_name: str):
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model_name: str = "gpt-3.5-turbo") -> int:
+    """Count the tokens of the text with the tokenizer of the model, or estimate them without tiktoken"""
+    if tiktoken is not None:
+        try:
+            return len(_get_encoding(model_name).encode(text))
+        except Exception as e:
+            # tiktoken downloads its encodings on first use, which fails when offline
+            logger.warning(f"Tokenizer of {model_name} is not available, estimating tokens: {e}")
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def relevance(entry, keywords: set) -> float:
+    """Fraction of the keywords mentioned in the entry"""
+    if not keywords:
+        return 0.0
+    text = str(entry).lower()
+    words = set(re.findall(r"[\w+#.]+", text))
+    return sum(1 for k in keywords if k in words or (" " in k and k in text)) / len(keywords)
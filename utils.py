@@ -1,7 +1,12 @@
+import functools
+import hashlib
+import json
 import logging
 import os
+import signal
 import subprocess
 import sys
+import uuid
 
 # import pdflatex
 from jinja2 import Environment, FileSystemLoader
@@ -9,12 +14,23 @@ from ruamel.yaml import YAML
 from ruamel.yaml.compat import StringIO
 from ruamel.yaml.error import YAMLError
 
+from render_cache import RenderCache
+
 # create logger
 logger = logging.getLogger(__name__)
 
 # create yaml
 yaml = YAML()
 
+# cache of rendered tex and pdf files, replaced with configure_render_cache()
+render_cache = RenderCache()
+
+
+def configure_render_cache(directory: str = ".render_cache", max_bytes: int = 512 * 1024 * 1024) -> None:
+    """Cache the rendered files in `directory`, e.g. from the Flask config"""
+    global render_cache
+    render_cache = RenderCache(directory=directory, max_bytes=max_bytes)
+
 
 def read_yaml(yaml_text: str = "", filename: str = "") -> dict:
     if not yaml_text and not filename:
@@ -70,6 +86,18 @@ def dict_to_yaml_string(d: dict) -> str:
     return stream.getvalue()
 
 
+def text_hash(text: str) -> str:
+    """Hash of the text that ignores differences in case and whitespace"""
+    normalized = " ".join(str(text).split()).lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def fingerprint(data) -> str:
+    """Hash of JSON serializable data that does not depend on the order of dict keys"""
+    content = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
 def generator_key_in_nested_dict(keys, nested):
     if hasattr(nested, "items"):
         for k, v in nested.items():
@@ -93,101 +121,140 @@ def get_dict_field(field: str, resume: dict):
     return None
 
 
-def generate_new_tex(yaml_file: str, template_file: str = None) -> str:
-    # set default template file. file location is relative to `templates` directory
-    if not template_file:
-        template_file = "resume.tex"
-
-    dirname, basename = os.path.split(yaml_file)
-    filename, ext = os.path.splitext(basename)
-    filename = os.path.join(dirname, filename)
-
-    # Set up jinja environment and template
-    env = Environment(
+@functools.lru_cache(maxsize=None)
+def get_tex_environment(template_dir: str = "templates") -> Environment:
+    """
+    Jinja environment for LaTeX templates, created once per template directory.
+    Compiled templates are cached and recompiled when the template file is modified.
+    """
+    return Environment(
         trim_blocks=True,
         lstrip_blocks=True,
-        block_start_string="\BLOCK{",
+        block_start_string=r"\BLOCK{",
         block_end_string="}",
-        variable_start_string="\VAR{",
+        variable_start_string=r"\VAR{",
         variable_end_string="}",
-        comment_start_string="\#{",
+        comment_start_string=r"\#{",
         comment_end_string="}",
         line_statement_prefix="%%",
         line_comment_prefix="%#",
         autoescape=False,
-        loader=FileSystemLoader("templates"),
+        auto_reload=True,
+        loader=FileSystemLoader(template_dir),
     )
-    template = env.get_template(template_file)
 
-    yaml_data = read_yaml(filename=yaml_file)
-    latex_string = template.render(**yaml_data)
 
-    with open(f"{filename}.tex", "wt", encoding='utf-8') as stream:
-        stream.write(latex_string)
-    print("Done")
+def render_key(data: dict, template_file: str = None, template_dir: str = "templates") -> str:
+    """Cache key of the outputs of a template rendered with `data`"""
+    if not template_file:
+        template_file = "resume.tex"
+    env = get_tex_environment(template_dir)
+    source, _, _ = env.loader.get_source(env, template_file)
+    return RenderCache.key(source, data)
 
 
-def generate_pdf(yaml_file: str, template_file: str = None) -> str:
-    # set default template file. file location is relative to `templates` directory
+def render_tex(data: dict, template_file: str = None, template_dir: str = "templates") -> str:
+    # set default template file. file location is relative to `template_dir` directory
     if not template_file:
         template_file = "resume.tex"
+    key = render_key(data, template_file=template_file, template_dir=template_dir)
+    latex_bytes = render_cache.get(key, ".tex")
+    if latex_bytes is not None:
+        return latex_bytes.decode("utf-8")
+
+    template = get_tex_environment(template_dir).get_template(template_file)
+    latex_string = template.render(**data)
+    render_cache.put(key, ".tex", latex_string.encode("utf-8"))
+    return latex_string
 
+
+def generate_new_tex(yaml_file: str, template_file: str = None) -> str:
     dirname, basename = os.path.split(yaml_file)
     filename, ext = os.path.splitext(basename)
     filename = os.path.join(dirname, filename)
 
     yaml_data = read_yaml(filename=yaml_file)
+    latex_string = render_tex(yaml_data, template_file=template_file)
+
+    with open(f"{filename}.tex", "wt", encoding='utf-8') as stream:
+        stream.write(latex_string)
+    print("Done")
 
-    # Set up jinja environment and template
-    env = Environment(
-        trim_blocks=True,
-        lstrip_blocks=True,
-        block_start_string="\BLOCK{",
-        block_end_string="}",
-        variable_start_string="\VAR{",
-        variable_end_string="}",
-        comment_start_string="\#{",
-        comment_end_string="}",
-        line_statement_prefix="%%",
-        line_comment_prefix="%#",
-        autoescape=False,
-        loader=FileSystemLoader("templates"),
-    )
-    template = env.get_template(template_file)
+
+def generate_pdf(yaml_file: str, template_file: str = None) -> str:
+    dirname, basename = os.path.split(yaml_file)
+    filename, ext = os.path.splitext(basename)
+    filename = os.path.join(dirname, filename)
 
     yaml_data = read_yaml(filename=yaml_file)
-    latex_string = template.render(**yaml_data)
+    latex_string = render_tex(yaml_data, template_file=template_file)
 
     with open(f"{filename}.tex", "wt", encoding='utf-8') as stream:
         stream.write(latex_string)
 
+    # reuse the pdf compiled earlier from the same template and data
+    key = render_key(yaml_data, template_file=template_file)
+    pdf = render_cache.get(key, ".pdf")
+    if pdf is not None:
+        with open(f"{filename}.pdf", "wb") as stream:
+            stream.write(pdf)
+        return f"{filename}.pdf"
+
     # convert to pdf and clean up temp files
-    jobname = os.path.join(dirname, "latexmk_temp")
-    cmd = subprocess.run(
+    jobname = os.path.join(dirname, f"latexmk_temp_{uuid.uuid4().hex}")
+    pdf_file = compile_latex(f"{filename}.tex", jobname=jobname)
+    # rename pdf
+    os.rename(pdf_file, f"{filename}.pdf")
+    with open(f"{filename}.pdf", "rb") as stream:
+        render_cache.put(key, ".pdf", stream.read())
+    subprocess.run(
         [
             "latexmk",
-            "-pdf",
+            "-c",
             f"-jobname={jobname}",
             f"{filename}.tex",
         ],
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
     )
-    # rename pdf
-    if os.path.isfile(f"{jobname}.pdf"):
-        os.rename(f"{jobname}.pdf", f"{filename}.pdf")
-        cmd = subprocess.run(
-            [
-                "latexmk",
-                "-c",
-                f"-jobname={jobname}",
-                f"{filename}.tex",
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-    else:
+    return f"{filename}.pdf"
+
+
+def compile_latex(tex_file: str, jobname: str, timeout: float = None) -> str:
+    """
+    Compile a tex file to pdf with latexmk.
+    Auxiliary files are left next to the pdf, so a later run with the same jobname can reuse them.
+    :param tex_file: Path of the tex file
+    :param jobname: Path of the output files, without extension
+    :param timeout: Seconds after which latexmk and its children are killed
+    :return: Path of the pdf file
+    """
+    pdf_file = f"{jobname}.pdf"
+    if os.path.isfile(pdf_file):
+        os.remove(pdf_file)
+    # run in its own session to kill the whole process group on timeout
+    process = subprocess.Popen(
+        [
+            "latexmk",
+            "-pdf",
+            "-interaction=nonstopmode",
+            f"-jobname={jobname}",
+            tex_file,
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        logger.error(f"PDF generation timed out after {timeout} seconds.")
+        raise e
+    if not os.path.isfile(pdf_file):
         message = f"PDF could not be generated. See latexmk logs {jobname}.log"
         logger.error(message)
         raise ValueError(message)
-    return f"{filename}.pdf"
+    return pdf_file
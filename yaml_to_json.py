@@ -83,6 +83,31 @@ def yaml_to_json(yaml):
     return web_json
 
 
+# Template category of the web skill groups filled from it by yaml_to_json
+WEB_SKILL_CATEGORIES = {"technologies": "Technical", "practices": "Non-technical"}
+
+
+def json_to_yaml(web_json):
+    """Convert a stored resume back to the shape of the LaTeX templates, which list skills by category"""
+    raw_json = dict(web_json)
+
+    # Skills
+    web_skill = web_json.get('skills')
+    if isinstance(web_skill, dict):
+        raw_skills = []
+        for group, skills in web_skill.items():
+            names = [skill.get('name') if isinstance(skill, dict) else skill for skill in skills or []]
+            names = [name for name in names if name]
+            if names:
+                raw_skills.append({
+                    "category": WEB_SKILL_CATEGORIES.get(group, group.capitalize()),
+                    "skills": names
+                })
+        raw_json['skills'] = raw_skills
+
+    return raw_json
+
+
 def main():
     # yaml_data = read_yaml(filename='./my_applications/resume_raw.yaml')
     # yaml_data = read_yaml(filename='my_applications/20230916__NOIR__VueJS Developer/VueJS Developer.yaml')